@@ -0,0 +1,170 @@
+import base64
+import json
+import os
+import struct
+from datetime import datetime
+from telethon.extensions import BinaryReader
+from telethon.tl.tlobject import TLObject
+from telethon.tl.types import MessageFwdHeader
+from utils import media_kind
+
+FORMAT = "telegram-forwarder-archive"
+VERSION = 1
+
+# one little-endian uint64 byte offset per record, so a replay can seek to record N directly
+_OFFSET = struct.Struct("<Q")
+
+def index_path(path):
+    return path + ".idx"
+
+def _media_blob(media):
+    # the TL serialization keeps the ids, access hashes and file references needed to resend the file
+    if not isinstance(media, TLObject):
+        return None
+    return base64.b64encode(bytes(media)).decode("ascii")
+
+def _encode(msg):
+    fwd_date = getattr(getattr(msg, "fwd_from", None), "date", None)
+    return {
+        "id": msg.id,
+        "date": msg.date.isoformat(),
+        "text": msg.text or "",
+        "media": _media_blob(msg.media),
+        "kind": media_kind(msg),
+        "grouped_id": getattr(msg, "grouped_id", None),
+        "fwd_date": fwd_date.isoformat() if fwd_date else None,
+    }
+
+class ArchivedMessage:
+    """A message read back from an archive, with the attributes the send pipeline uses."""
+
+    def __init__(self, chat_id, record):
+        self.chat_id = chat_id
+        self.id = record["id"]
+        self.date = datetime.fromisoformat(record["date"])
+        # text keeps the formatting entities as HTML, the way the client renders it for copy mode
+        self.text = record["text"]
+        self.message = record["text"]
+        blob = record.get("media")
+        self.media = BinaryReader(base64.b64decode(blob)).tgread_object() if blob else None
+        self.grouped_id = record.get("grouped_id")
+        fwd_date = record.get("fwd_date")
+        self.fwd_from = MessageFwdHeader(date=datetime.fromisoformat(fwd_date)) if fwd_date else None
+        # media_kind() asks the message for these, the way telethon's Message exposes them
+        kind = record.get("kind")
+        for name in ("gif", "sticker", "voice", "video", "audio", "photo", "poll"):
+            setattr(self, name, name == kind)
+
+class ArchiveWriter:
+    """Appends matched units to a JSON-lines archive and their offsets to the index next to it."""
+
+    def __init__(self, path):
+        self.path = path
+        dirn = os.path.dirname(path)
+        if dirn:
+            os.makedirs(dirn, exist_ok=True)
+        appending = os.path.exists(path) and os.path.getsize(path) > 0
+        if appending:
+            self._recover()
+        self._file = open(path, "ab")
+        self._index = open(index_path(path), "ab" if appending else "wb")
+        self.records = 0
+        self.messages = 0
+        if self._file.tell() == 0:
+            self._file.write(json.dumps({"format": FORMAT, "version": VERSION}).encode("utf-8") + b"\n")
+
+    def _recover(self):
+        # appending to an earlier export: rebuild its index and drop a partial last record left by an
+        # interrupted run, so new records start on a line of their own
+        with open(self.path, "r+b") as f, open(index_path(self.path), "wb") as idx:
+            header = f.readline()
+            good = f.tell() if header.endswith(b"\n") else 0
+            if good:
+                for line in iter(f.readline, b""):
+                    if not line.endswith(b"\n"):
+                        break
+                    idx.write(_OFFSET.pack(good))
+                    good += len(line)
+            f.truncate(good)
+
+    def write(self, src, unit):
+        line = json.dumps({"src": src, "messages": [_encode(m) for m in unit]}, ensure_ascii=False, separators=(",", ":"))
+        self._index.write(_OFFSET.pack(self._file.tell()))
+        self._file.write(line.encode("utf-8") + b"\n")
+        self.records += 1
+        self.messages += len(unit)
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+        except OSError as e:
+            raise ValueError(f"Cannot read archive {path}: {e}")
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a forwarder archive")
+        if header.get("version", 0) > VERSION:
+            raise ValueError(f"{path} was written by a newer version (archive format {header['version']})")
+
+    def __len__(self):
+        try:
+            return os.path.getsize(index_path(self.path)) // _OFFSET.size
+        except OSError:
+            return 0
+
+    def _offset(self, start):
+        if start <= 0:
+            return None
+        try:
+            with open(index_path(self.path), "rb") as idx:
+                idx.seek(start * _OFFSET.size)
+                raw = idx.read(_OFFSET.size)
+        except OSError:
+            raise ValueError(f"{self.path} has no index; replay it from the start")
+        if len(raw) < _OFFSET.size:
+            return -1
+        return _OFFSET.unpack(raw)[0]
+
+    def units(self, start=0):
+        # one line at a time, so memory stays flat however large the archive is
+        offset = self._offset(start)
+        if offset == -1:
+            return
+        with open(self.path, "rb") as f:
+            if offset is None:
+                f.readline()
+            else:
+                f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # a partial last line from an interrupted export
+                    return
+                record = json.loads(line)
+                src = record["src"]
+                yield src, [ArchivedMessage(src, m) for m in record["messages"]]
+
+class ArchiveSink:
+    """Sink for export runs: matched units go to the archive instead of the destinations."""
+
+    def __init__(self, forwarder, src, writer):
+        self.forwarder = forwarder
+        self.src = src
+        self.writer = writer
+
+    async def push(self, unit, dests):
+        # checkpoints are left alone, so exporting never makes a later live run skip messages
+        self.forwarder.metrics.messages.inc(self.src, "yes" if dests else "no")
+        if not dests:
+            return 0
+        self.writer.write(self.src, unit)
+        return len(unit)
+
+    async def flush(self):
+        return 0
@@ -0,0 +1,84 @@
+import asyncio
+from colorama import Fore
+
+# telegram accepts at most 100 message ids per forwardMessages request
+MAX_FORWARD_BATCH = 100
+
+class DirectSink:
+    def __init__(self, forwarder, src, live=False):
+        self.forwarder = forwarder
+        self.src = src
+        self.live = live
+
+    async def push(self, unit, dests):
+        # dests are the destinations the unit is routed to; empty means it did not match
+        self.forwarder.metrics.messages.inc(self.src, "yes" if dests else "no")
+        sent = 0
+        if dests:
+            sent = await self.forwarder._fan_out(self.src, unit, dests, live=self.live)
+        self.forwarder.checkpoints.update(self.src, unit[-1].id)
+        return sent
+
+    async def flush(self):
+        return 0
+
+class ForwardBatch:
+    def __init__(self, forwarder, src, size=MAX_FORWARD_BATCH, live=False, window=0.0):
+        self.forwarder = forwarder
+        self.src = src
+        self.size = max(1, min(int(size), MAX_FORWARD_BATCH))
+        self.live = live
+        self.window = window
+        self.units = []
+        self.pending = 0
+        self.last_id = None
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    async def push(self, unit, dests):
+        self.forwarder.metrics.messages.inc(self.src, "yes" if dests else "no")
+        self.last_id = unit[-1].id
+        if not dests:
+            # the checkpoint may only move past ids whose batch has been confirmed
+            if not self.units and not self._lock.locked():
+                self.forwarder.checkpoints.update(self.src, self.last_id)
+            return 0
+        sent = 0
+        if self.units and self.pending + len(unit) > self.size:
+            sent += await self._flush(unit[0].id - 1)
+        self.units.append((unit, dests))
+        self.pending += len(unit)
+        if self.pending >= self.size:
+            sent += await self.flush()
+        elif self.window > 0 and self._timer is None:
+            self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+        return sent
+
+    async def flush(self):
+        return await self._flush(self.last_id)
+
+    async def _flush(self, checkpoint_id):
+        timer, self._timer = self._timer, None
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        async with self._lock:
+            units, self.units = self.units, []
+            self.pending = 0
+            sent = 0
+            if units:
+                msgs = [m for u, _ in units for m in u]
+                dests_for = {m.id: dests for u, dests in units for m in u}
+                sent = await self.forwarder._fan_out_batch(self.src, msgs, dests_for, live=self.live)
+            if checkpoint_id is not None:
+                self.forwarder.checkpoints.update(self.src, checkpoint_id)
+            return sent
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.window)
+            self._timer = None
+            await self.flush()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(Fore.RED + f"Error flushing live batch from {self.src}: {e}")
@@ -0,0 +1,243 @@
+import asyncio
+import random
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from telethon import events
+from telethon.errors import FloodWaitError, SlowModeWaitError
+from telethon.tl.types import MessageMediaPhoto, Photo, InputMediaPhoto
+
+BASE_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TAG_RE = re.compile(r"\[(-?\d+):(\d+)\]")
+
+class FakeMessage:
+    def __init__(self, client, chat_id, id, text, date, media=None, grouped_id=None):
+        self._client = client
+        self.chat_id = chat_id
+        self.id = id
+        self.text = text
+        self.message = text
+        self.date = date
+        self.media = media
+        self.grouped_id = grouped_id
+        self.fwd_from = None
+        self.entities = None
+
+    async def forward_to(self, entity):
+        return await self._client.forward_messages(entity, [self.id], from_peer=self.chat_id)
+
+class FakeEvent:
+    def __init__(self, chat_id, messages):
+        self.chat_id = chat_id
+        self.messages = messages
+        self.message = messages[0]
+
+class FakeTelegramClient:
+    """In-process stand-in for TelegramClient with simulated latency and flood errors."""
+
+    # set by the benchmark before a Forwarder is built; every client the forwarder creates shares it
+    network = None
+
+    def __init__(self, session=None, api_id=None, api_hash=None, network=None, **kwargs):
+        self.session = session
+        self.parse_mode = None
+        self.net = network or FakeTelegramClient.network
+        self._handlers = []
+        self._disconnected = asyncio.Event()
+
+    async def start(self, *args, **kwargs):
+        return self
+
+    def is_connected(self):
+        return not self._disconnected.is_set()
+
+    async def disconnect(self):
+        self._disconnected.set()
+
+    async def run_until_disconnected(self):
+        await self._disconnected.wait()
+
+    async def get_dialogs(self, *args, **kwargs):
+        return []
+
+    async def get_entity(self, entity):
+        return entity
+
+    def on(self, event):
+        def decorator(fn):
+            self.add_event_handler(fn, event)
+            return fn
+        return decorator
+
+    def add_event_handler(self, callback, event=None):
+        self._handlers.append((event, callback))
+        self.net.handlers_ready.set()
+
+    def remove_event_handler(self, callback, event=None):
+        self._handlers = [h for h in self._handlers if h[1] != callback]
+
+    async def iter_messages(self, entity, limit=None, offset_date=None, max_id=0, min_id=0, reverse=False, search=None, wait_time=None, **kwargs):
+        history = self.net.history.get(entity, [])
+        yielded = 0
+        for m in (history if reverse else reversed(history)):
+            if min_id and m.id <= min_id:
+                continue
+            if max_id and m.id >= max_id:
+                continue
+            if offset_date is not None and (m.date < offset_date if reverse else m.date >= offset_date):
+                continue
+            if search and search.lower() not in (m.text or "").lower():
+                continue
+            if yielded % self.net.page_size == 0:
+                await self.net.request_delay()
+            self.net.seen(entity, m.id)
+            yield m
+            yielded += 1
+            if limit and yielded >= limit:
+                return
+
+    async def get_messages(self, entity, limit=None, ids=None, **kwargs):
+        if ids is None:
+            return [m async for m in self.iter_messages(entity, limit=limit, **kwargs)]
+        await self.net.request_delay()
+        index = self.net.index.get(entity, {})
+        if isinstance(ids, list):
+            return [index.get(i) for i in ids]
+        return index.get(ids)
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        messages = messages if isinstance(messages, list) else [messages]
+        if messages and hasattr(messages[0], "id"):
+            from_peer = messages[0].chat_id
+            messages = [m.id for m in messages]
+        await self.net.send(entity)
+        self.net.delivered(entity, [(from_peer, i) for i in messages])
+        return [FakeMessage(self, entity, i, None, datetime.now(timezone.utc)) for i in messages]
+
+    async def send_message(self, entity, message, **kwargs):
+        await self.net.send(entity)
+        self.net.delivered(entity, [(int(c), int(i)) for c, i in TAG_RE.findall(message or "")[:1]])
+        return FakeMessage(self, entity, 0, message, datetime.now(timezone.utc))
+
+    async def send_file(self, entity, file, caption=None, **kwargs):
+        files = file if isinstance(file, list) else [file]
+        await self.net.send(entity)
+        keys = []
+        sent = []
+        for f in files:
+            # accepts both source media and the InputMediaPhoto references the media cache hands back
+            photo = f.id if isinstance(f, InputMediaPhoto) else getattr(f, "photo", None)
+            photo_id = getattr(photo, "id", None)
+            key = self.net.media_owner.get(photo_id)
+            if key is not None:
+                keys.append(key)
+            sent.append(FakeMessage(self, entity, 0, None, datetime.now(timezone.utc), media=self.net.photos.get(photo_id)))
+        self.net.delivered(entity, keys)
+        return sent if isinstance(file, list) else sent[0]
+
+class FakeNetwork:
+    """Shared state behind every fake client: history, latency, error injection and delivery log."""
+
+    def __init__(self, latency=0.0, jitter=0.0, flood_every=0, flood_seconds=0, slow_mode_every=0, slow_mode_seconds=0, page_size=100, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.slow_mode_every = slow_mode_every
+        self.slow_mode_seconds = slow_mode_seconds
+        self.page_size = max(1, page_size)
+        self.random = random.Random(seed)
+        self.history = {}
+        self.index = {}
+        self.media_owner = {}
+        self.photos = {}
+        self.handlers_ready = asyncio.Event()
+        self.requests = 0
+        self.sends = 0
+        self.floods = 0
+        self.deliveries = 0
+        self.first_seen = {}
+        self.latencies = []
+        self.target = None
+        self._done = asyncio.Event()
+        self._client = FakeTelegramClient("history", network=self)
+
+    def populate(self, chat_id, count, text_for, media_every=0, album_every=0, album_size=3, start_id=1, spacing=timedelta(minutes=1)):
+        messages = self.history.setdefault(chat_id, [])
+        index = self.index.setdefault(chat_id, {})
+        msg_id = start_id
+        i = 0
+        while i < count:
+            size = album_size if album_every and i % album_every == album_every - 1 and count - i >= album_size else 1
+            grouped_id = (chat_id * 1000003 + msg_id) & 0x7FFFFFFF if size > 1 else None
+            for _ in range(size):
+                media = None
+                if grouped_id or (media_every and i % media_every == 0):
+                    media = self._photo(chat_id, msg_id)
+                text = f"{text_for(chat_id, msg_id)} [{chat_id}:{msg_id}]"
+                m = FakeMessage(self._client, chat_id, msg_id, text, BASE_DATE + spacing * msg_id, media, grouped_id)
+                messages.append(m)
+                index[msg_id] = m
+                msg_id += 1
+                i += 1
+        return messages
+
+    def _photo(self, chat_id, msg_id):
+        photo_id = (abs(chat_id) << 24) + msg_id
+        self.media_owner[photo_id] = (chat_id, msg_id)
+        media = MessageMediaPhoto(photo=Photo(id=photo_id, access_hash=photo_id, file_reference=b"", date=BASE_DATE, sizes=[], dc_id=1))
+        self.photos[photo_id] = media
+        return media
+
+    async def request_delay(self):
+        self.requests += 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        await asyncio.sleep(delay)
+
+    async def send(self, entity):
+        await self.request_delay()
+        self.sends += 1
+        if self.flood_every and self.sends % self.flood_every == 0:
+            self.floods += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+        if self.slow_mode_every and self.sends % self.slow_mode_every == 0:
+            self.floods += 1
+            raise SlowModeWaitError(request=None, capture=self.slow_mode_seconds)
+
+    def seen(self, chat_id, msg_id):
+        self.first_seen.setdefault((chat_id, msg_id), time.perf_counter())
+
+    def delivered(self, entity, keys):
+        now = time.perf_counter()
+        for key in keys:
+            started = self.first_seen.get(key)
+            if started is not None:
+                self.latencies.append(now - started)
+        self.deliveries += len(keys)
+        if self.target is not None and self.deliveries >= self.target:
+            self._done.set()
+
+    def expect(self, deliveries):
+        self.target = deliveries
+        self._done.clear()
+        if self.deliveries >= deliveries:
+            self._done.set()
+
+    async def wait_delivered(self, timeout):
+        await asyncio.wait_for(self._done.wait(), timeout)
+
+    async def emit(self, client, chat_id, messages):
+        # live updates: every part goes through NewMessage, albums are also delivered as one Album event
+        now = time.perf_counter()
+        for m in messages:
+            self.first_seen.setdefault((chat_id, m.id), now)
+        for event, callback in list(client._handlers):
+            chats = getattr(event, "chats", None)
+            if chats is not None and chat_id not in chats:
+                continue
+            if isinstance(event, events.Album):
+                if messages[0].grouped_id is not None:
+                    await callback(FakeEvent(chat_id, messages))
+            elif isinstance(event, events.NewMessage):
+                for m in messages:
+                    await callback(FakeEvent(chat_id, [m]))
@@ -0,0 +1,311 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core
+from bench.fake_telegram import FakeNetwork, FakeTelegramClient
+
+UNLIMITED = {
+    "account_rate": 1e9,
+    "account_burst": 1e9,
+    "destination_rate": 1e9,
+    "destination_burst": 1e9,
+}
+
+def _keywords(n):
+    return [f"kw{i:05d}" for i in range(n)]
+
+def _text_every(keywords, every):
+    def text_for(chat_id, msg_id):
+        if msg_id % every == 0:
+            return f"breaking update {keywords[msg_id % len(keywords)]} from the newsroom"
+        return "ordinary chatter without anything interesting in it"
+    return text_for
+
+def _config(workdir, sources, destinations, **over):
+    cfg = {
+        "api_id": 1,
+        "api_hash": "bench",
+        "phone": "+10000000000",
+        "session_name": os.path.join(workdir, "bench"),
+        "sources": sources,
+        "destinations": destinations,
+        "keywords": ["kw00000"],
+        "mode": "past",
+        "scan_old": True,
+        "scan_all": True,
+        "show_forward_tag": True,
+        "rate_limits": dict(UNLIMITED),
+        "history_prefetch": {"wait_time": 0},
+        "state_file": os.path.join(workdir, "state.json"),
+        "state_db": os.path.join(workdir, "state.db"),
+        "date_index_file": os.path.join(workdir, "date_index.json"),
+        "outbox": {"path": os.path.join(workdir, "outbox.db")},
+        "dedup": {"path": os.path.join(workdir, "dedup.json")},
+        "live_queue": {"spill_file": os.path.join(workdir, "spill.jsonl"), "report_interval": 0},
+        "metrics": {"summary_interval": 0},
+        "config_reload": False,
+        "catch_up": False,
+    }
+    cfg.update(over)
+    return cfg
+
+def backfill_forward(net, workdir, scale):
+    keywords = _keywords(20)
+    sources = [-1001, -1002, -1003, -1004]
+    for src in sources:
+        net.populate(src, 5000 * scale, _text_every(keywords, 2))
+    return _config(workdir, sources, [-2001, -2002, -2003], keywords=keywords), False
+
+def backfill_copy(net, workdir, scale):
+    keywords = _keywords(20)
+    sources = [-1001, -1002]
+    for src in sources:
+        net.populate(src, 1000 * scale, _text_every(keywords, 2), media_every=5, album_every=25)
+    cfg = _config(workdir, sources, [-2001, -2002, -2003], keywords=keywords, show_forward_tag=False, highlight_keywords=True, remove_signature=True, signature_delimiters=["--"])
+    return cfg, False
+
+def id_range(net, workdir, scale):
+    keywords = _keywords(20)
+    sources = [-1001, -1002, -1003, -1004]
+    for src in sources:
+        net.populate(src, 5000 * scale, _text_every(keywords, 2))
+    cfg = _config(workdir, sources, [-2001, -2002], keywords=keywords, mode="id_range", id_min=1000, id_max=1000 + 3000 * scale)
+    return cfg, False
+
+def many_keywords(net, workdir, scale):
+    keywords = _keywords(5000)
+    sources = [-1001, -1002]
+    for src in sources:
+        net.populate(src, 5000 * scale, _text_every(keywords, 10))
+    return _config(workdir, sources, [-2001], keywords=keywords, exclude_keywords=_keywords(20)[10:]), False
+
+def many_destinations(net, workdir, scale):
+    keywords = _keywords(20)
+    net.populate(-1001, 400 * scale, _text_every(keywords, 1), media_every=4)
+    dests = [-2000 - i for i in range(50)]
+    return _config(workdir, [-1001], dests, keywords=keywords, show_forward_tag=False), False
+
+def flood_wait(net, workdir, scale):
+    keywords = _keywords(20)
+    sources = [-1001, -1002]
+    for src in sources:
+        net.populate(src, 500 * scale, _text_every(keywords, 1))
+    # each injected error parks the destination for at least a second, so keep them few
+    net.flood_every = 1000
+    net.slow_mode_every = 2500
+    cfg = _config(workdir, sources, [-2001, -2002, -2003], keywords=keywords, show_forward_tag=False)
+    return cfg, False
+
+def _sparse(net, workdir, scale, search):
+    keywords = _keywords(3)
+    net.populate(-1001, 20000 * scale, _text_every(keywords, 1000), album_every=3000)
+    return _config(workdir, [-1001], [-2001], keywords=keywords, whole_word_keywords=True, search_scan=search), False
+
+def sparse_full_scan(net, workdir, scale):
+    return _sparse(net, workdir, scale, False)
+
+def sparse_search(net, workdir, scale):
+    return _sparse(net, workdir, scale, True)
+
+def unicode_keywords(net, workdir, scale):
+    # casefolding changes the length of "İ" and "ß", which must not stop them matching or highlighting
+    texts = ["flights to İstanbul today", "roadworks on the Hauptstraße tonight", "ordinary chatter"]
+    net.populate(-1001, 300 * scale, lambda chat_id, msg_id: texts[msg_id % 3])
+    net.expect(200 * scale)
+    cfg = _config(workdir, [-1001], [-2001], keywords=["İstanbul", "STRASSE"], show_forward_tag=False, highlight_keywords=True)
+    return cfg, False
+
+def live_burst(net, workdir, scale):
+    keywords = _keywords(20)
+    sources = [-1001, -1002, -1003, -1004]
+    for src in sources:
+        net.populate(src, 1000 * scale, _text_every(keywords, 2), album_every=50)
+    cfg = _config(workdir, sources, [-2001, -2002, -2003], keywords=keywords, mode="live", scan_old=False, live_queue={"spill_file": os.path.join(workdir, "spill.jsonl"), "report_interval": 0, "maxsize": 5000})
+    return cfg, True
+
+def routing(net, workdir, scale):
+    # one reader feeding per-topic routes, instead of one process per topic re-reading the same sources
+    keywords = _keywords(20)
+    sources = [-1001, -1002, -1003, -1004]
+    for src in sources:
+        net.populate(src, 5000 * scale, _text_every(keywords, 5), media_every=9)
+    routes = [
+        {"sources": sources, "destinations": [-2001 - i], "keywords": keywords[i::4]}
+        for i in range(4)
+    ]
+    routes.append({"sources": sources[:2], "destinations": [-2010], "keywords": keywords, "media": ["photo"]})
+    return _config(workdir, [], [], routes=routes), False
+
+async def _emit_tail(fwd, net):
+    # a restart after downtime: the startup catch-up backfills the gap while the newest posts also arrive live
+    await net.handlers_ready.wait()
+    expected = 0
+    tails = []
+    for src in fwd.sources:
+        mark = fwd.checkpoints.get(src)
+        missed = [m for m in net.history[src] if m.id > mark]
+        expected += sum(len(fwd.routes.destinations_for(src, [m])) for m in missed)
+        tails.append((src, missed[-len(missed) // 4:]))
+    net.expect(expected)
+    for i in range(max(len(t) for _, t in tails)):
+        for src, tail in tails:
+            if i < len(tail):
+                await net.emit(fwd.client, src, [tail[i]])
+    await net.wait_delivered(timeout=600)
+    await fwd.client.disconnect()
+
+def catch_up(net, workdir, scale):
+    keywords = _keywords(20)
+    sources = [-1001, -1002, -1003, -1004]
+    for src in sources:
+        net.populate(src, 4000 * scale, _text_every(keywords, 2))
+    with open(os.path.join(workdir, "state.json"), "w", encoding="utf-8") as f:
+        json.dump({str(src): 2000 * scale for src in sources}, f)
+    cfg = _config(workdir, sources, [-2001, -2002], keywords=keywords, mode="live", scan_old=False, catch_up={"interval": 0})
+    return cfg, _emit_tail
+
+SCENARIOS = {
+    "backfill_forward": backfill_forward,
+    "backfill_copy": backfill_copy,
+    "id_range": id_range,
+    "many_keywords": many_keywords,
+    "many_destinations": many_destinations,
+    "flood_wait": flood_wait,
+    "sparse_full_scan": sparse_full_scan,
+    "sparse_search": sparse_search,
+    "unicode_keywords": unicode_keywords,
+    "live_burst": live_burst,
+    "routing": routing,
+    "catch_up": catch_up,
+}
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def _emit_history(fwd, net):
+    # replays each source's history as live updates, interleaving sources the way a busy account would
+    await net.handlers_ready.wait()
+    expected = 0
+    streams = []
+    for src in fwd.sources:
+        units = []
+        for m in net.history[src]:
+            if units and m.grouped_id is not None and units[-1][0].grouped_id == m.grouped_id:
+                units[-1].append(m)
+            else:
+                units.append([m])
+        streams.append((src, units))
+        expected += sum(len(u) * len(fwd.routes.destinations_for(src, u)) for u in units)
+    net.expect(expected)
+    for i in range(max(len(u) for _, u in streams)):
+        for src, units in streams:
+            if i < len(units):
+                await net.emit(fwd.client, src, units[i])
+    await net.wait_delivered(timeout=600)
+    await fwd.client.disconnect()
+
+async def _run_scenario(name, latency, jitter, scale):
+    net = FakeNetwork(latency=latency, jitter=jitter)
+    FakeTelegramClient.network = net
+    core.TelegramClient = FakeTelegramClient
+    with tempfile.TemporaryDirectory() as workdir:
+        cfg, live = SCENARIOS[name](net, workdir, scale)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            fwd = core.Forwarder(cfg)
+            await fwd.start()
+            started = time.perf_counter()
+            feeder = None
+            if live:
+                feed = _emit_history if live is True else live
+                feeder = asyncio.get_running_loop().create_task(feed(fwd, net))
+            await fwd.run()
+            if feeder is not None:
+                await feeder
+            elapsed = time.perf_counter() - started
+    if net.target is not None and net.deliveries < net.target:
+        raise SystemExit(f"{name}: {net.deliveries} of {net.target} expected deliveries")
+    scanned = len(net.first_seen)
+    return {
+        "messages": scanned,
+        "deliveries": net.deliveries,
+        "requests": net.requests,
+        "floods": net.floods,
+        "seconds": elapsed,
+        "msgs_per_sec": scanned / elapsed if elapsed else 0.0,
+        "p50_ms": (_percentile(net.latencies, 0.5) or 0.0) * 1000,
+        "p99_ms": (_percentile(net.latencies, 0.99) or 0.0) * 1000,
+    }
+
+def run_scenario(name, latency=0.0, jitter=0.0, scale=1, memory=True):
+    result = asyncio.run(_run_scenario(name, latency, jitter, scale))
+    if memory:
+        # traced separately because tracemalloc slows the interpreter down several times
+        tracemalloc.start()
+        asyncio.run(_run_scenario(name, latency, jitter, scale))
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return result
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if res["msgs_per_sec"] < base["msgs_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {res['msgs_per_sec']:.0f} msg/s vs {base['msgs_per_sec']:.0f} baseline")
+        if base.get("p99_ms") and res["p99_ms"] > base["p99_ms"] * (1 + tolerance) + 1:
+            regressions.append(f"{name}: p99 {res['p99_ms']:.1f}ms vs {base['p99_ms']:.1f}ms baseline")
+        if base.get("peak_mb") and res.get("peak_mb") and res["peak_mb"] > base["peak_mb"] * (1 + tolerance) + 1:
+            regressions.append(f"{name}: peak {res['peak_mb']:.1f}MB vs {base['peak_mb']:.1f}MB baseline")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline forwarder benchmarks against an in-process fake Telegram client.")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds per request, up to this value")
+    parser.add_argument("--scale", type=int, default=1, help="multiply the message counts")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--save", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression against the baseline")
+    args = parser.parse_args(argv)
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    results = {}
+    print(f"{'scenario':<18} {'msgs':>7} {'sent':>7} {'secs':>7} {'msg/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'peak MB':>8}")
+    for name in names:
+        res = run_scenario(name, args.latency, args.jitter, args.scale, memory=not args.no_memory)
+        results[name] = res
+        peak = f"{res['peak_mb']:.1f}" if "peak_mb" in res else "-"
+        print(f"{name:<18} {res['messages']:>7} {res['deliveries']:>7} {res['seconds']:>7.2f} {res['msgs_per_sec']:>9.0f} {res['p50_ms']:>8.1f} {res['p99_ms']:>8.1f} {peak:>8}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import asyncio
+from colorama import Fore
+
+class CatchUp:
+    """Backfills the id ranges a source posted while the listener wasn't receiving them.
+
+    A gap shows up either against the channel's latest id (checked at startup and every
+    interval) or as a jump in the ids the live handler sees, which is how the first post
+    after a reconnect reveals what was missed in between. Only the missing range is read,
+    through the same sinks as everything else, while live traffic keeps flowing.
+    """
+
+    def __init__(self, forwarder, interval=60.0, max_messages=10000):
+        self.forwarder = forwarder
+        self.interval = interval
+        self.max_messages = max_messages
+        # highest id per source that live traffic or a backfill has accounted for
+        self.seen = {}
+        # src -> [top, ids]: ids up to top handled while a backfill may still overlap live traffic
+        self._claims = {}
+        self._pending = {}
+        self._workers = {}
+        self._failed = set()
+        self._slots = None
+        self._task = None
+
+    def start(self):
+        # call before the live handlers are registered, so the stored checkpoints predate any live message
+        if self._task is not None:
+            return
+        fwd = self.forwarder
+        for src in fwd.sources:
+            mark = fwd.checkpoints.get(src)
+            if mark:
+                self.seen[src] = mark
+        self._slots = asyncio.Semaphore(fwd.backfill_concurrency)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            for src in self.forwarder.sources:
+                if not self.seen.get(src):
+                    # nothing stored for this source yet, so there is no gap to measure
+                    continue
+                try:
+                    await self.check(src)
+                except Exception as e:
+                    print(Fore.RED + f"Catch-up check failed for source {src}: {e}")
+            if not self.interval:
+                return
+            await asyncio.sleep(self.interval)
+
+    async def check(self, src):
+        latest = await self.forwarder.client.get_messages(src, limit=1)
+        if latest:
+            self._gap(src, latest[0].id + 1)
+
+    def observe(self, src, unit):
+        # called by the live handler; False means a backfill already took this message
+        first = unit[0].id
+        claim = self._claims.get(src)
+        if claim is not None:
+            if first <= claim[0]:
+                if first in claim[1]:
+                    return False
+                claim[1].update(m.id for m in unit)
+            elif src not in self._workers:
+                # updates arrive in order, so nothing from the backfilled range can still come in live
+                del self._claims[src]
+        self._gap(src, first)
+        if unit[-1].id > self.seen.get(src, 0):
+            self.seen[src] = unit[-1].id
+        return True
+
+    def _claim(self, src, unit):
+        ids = self._claims[src][1]
+        if unit[0].id in ids:
+            return False
+        ids.update(m.id for m in unit)
+        return True
+
+    def _gap(self, src, end):
+        # queues the ids strictly between what was seen and end
+        start = self.seen.get(src, 0)
+        if not start or end <= start + 1:
+            return
+        self.seen[src] = end - 1
+        if self.max_messages and end - start - 1 > self.max_messages:
+            skipped = end - 1 - self.max_messages
+            # the checkpoint moves past the skipped ids once the rest is caught up, so name them exactly
+            print(Fore.YELLOW + f"Source {src} missed {end - start - 1} messages; catching up on the last {self.max_messages}. IDs {start + 1} to {skipped} are skipped: forward them with mode 'id_range', id_min {start + 1} and id_max {skipped}.")
+            start = skipped
+        # live messages move the checkpoint past the gap; what is saved must not, or a crash now loses it
+        self.forwarder.checkpoints.hold(src, start)
+        claim = self._claims.setdefault(src, [0, set()])
+        claim[0] = max(claim[0], end - 1)
+        # ranges stay separate: live traffic between two of them has already been handled
+        self._pending.setdefault(src, []).append((start, end))
+        if src not in self._workers:
+            self._workers[src] = asyncio.get_running_loop().create_task(self._drain(src))
+
+    async def _drain(self, src):
+        try:
+            async with self._slots:
+                while self._pending.get(src):
+                    start, end = self._pending[src].pop(0)
+                    try:
+                        await self._backfill(src, start, end)
+                    except Exception as e:
+                        self._failed.add(src)
+                        print(Fore.RED + f"Catch-up of source {src} (IDs {start + 1}-{end - 1}) failed: {e}")
+            if src in self._failed:
+                # the saved checkpoint stays before the failed range, so the next start retries it
+                print(Fore.YELLOW + f"Source {src} keeps its saved checkpoint before the missed messages until a restart catches up.")
+            else:
+                self.forwarder.checkpoints.release(src)
+        finally:
+            self._pending.pop(src, None)
+            self._workers.pop(src, None)
+
+    async def _backfill(self, src, start, end):
+        fwd = self.forwarder
+        print(Fore.CYAN + f"Catching up source {src}: IDs {start + 1} to {end - 1}")
+        sink = fwd._source_sink(src)
+        history = fwd._history(src, start, end)
+        count = found = 0
+        try:
+            async for unit in fwd._group_albums(history):
+                if not self._claim(src, unit):
+                    continue
+                found += len(unit)
+                count += await sink.push(unit, fwd._live_destinations(src, unit))
+        finally:
+            await history.aclose()
+        count += await sink.flush()
+        fwd.metrics.caught_up.inc(src, amount=found)
+        print(Fore.GREEN + f"Caught up source {src}: {found} missed message(s), {count} forwarded.")
+
+    async def close(self):
+        tasks = list(self._workers.values())
+        if self._task is not None:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+def build_catch_up(cfg, forwarder):
+    raw = cfg.get("catch_up", {})
+    if raw is False:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("catch_up must be an object or false")
+    if not raw.get("enabled", True):
+        return None
+    try:
+        interval = float(raw.get("interval", 60))
+    except (ValueError, TypeError):
+        raise ValueError("catch_up.interval must be a number")
+    if interval < 0:
+        raise ValueError("catch_up.interval must not be negative")
+    try:
+        max_messages = int(raw.get("max_messages", 10000))
+    except (ValueError, TypeError):
+        raise ValueError("catch_up.max_messages must be an integer")
+    return CatchUp(forwarder, interval, max(0, max_messages))
@@ -4,6 +4,13 @@ import os
 CONFIG_DIR = "data"
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
 
+def config_path():
+    if os.path.exists(CONFIG_FILE):
+        return CONFIG_FILE
+    if os.path.exists("config.json"):
+        return "config.json"
+    return None
+
 def load_config():
     if os.path.exists(CONFIG_FILE):
         try:
@@ -30,16 +37,13 @@ def load_config():
             return None
     else:
         return None
-    cfg.pop("min_send_interval", None)
-    cfg.pop("max_flood_wait", None)
     return cfg
 
 def save_config(cfg):
     try:
         os.makedirs(CONFIG_DIR, exist_ok=True)
         with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            filtered = {k: v for k, v in cfg.items() if k not in {"min_send_interval", "max_flood_wait"}}
-            json.dump(filtered, f, indent=4, ensure_ascii=False)
+            json.dump(cfg, f, indent=4, ensure_ascii=False)
     except Exception as e:
         print(f"Error saving config file '{CONFIG_FILE}': {e}")
         raise
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import signal
+from colorama import Fore
+from config_manager import load_config, config_path
+
+class ConfigWatcher:
+    """Feeds config file changes (polled by mtime) and SIGHUP into a reload callback."""
+
+    def __init__(self, reload, interval=2.0):
+        self.reload = reload
+        self.interval = float(interval)
+        self._mtime = self._stat()
+        self._task = None
+        self._sighup = False
+
+    def _stat(self):
+        path = config_path()
+        if path is None:
+            return None
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self, force=False):
+        mtime = self._stat()
+        if mtime is None or (mtime == self._mtime and not force):
+            return
+        self._mtime = mtime
+        cfg = load_config()
+        if cfg is None:
+            print(Fore.RED + "Config reload skipped: the config file could not be read.")
+            return
+        try:
+            self.reload(cfg)
+        except Exception as e:
+            # an unexpected error must not end the polling task, or later edits would go unnoticed
+            print(Fore.RED + f"Config reload failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
+
+    def start(self):
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._run())
+        if hasattr(signal, "SIGHUP"):
+            try:
+                loop.add_signal_handler(signal.SIGHUP, self.check, True)
+                self._sighup = True
+            except (NotImplementedError, RuntimeError, ValueError):
+                # no signal support on this platform or outside the main thread; polling still works
+                pass
+
+    async def close(self):
+        if self._sighup:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            self._sighup = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+def build_config_watcher(cfg, reload):
+    raw = cfg.get("config_reload", {})
+    if raw is False:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("config_reload must be an object or false")
+    if not raw.get("enabled", True):
+        return None
+    try:
+        interval = float(raw.get("interval", 2))
+    except (ValueError, TypeError):
+        raise ValueError("config_reload.interval must be a number")
+    if interval <= 0:
+        raise ValueError("config_reload.interval must be positive")
+    return ConfigWatcher(reload, interval)
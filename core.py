@@ -1,21 +1,48 @@
 import asyncio
-import os
-from datetime import datetime, timezone
+import time
+from datetime import datetime
 from telethon import TelegramClient, events
 from telethon.errors.rpcerrorlist import FloodWaitError, SlowModeWaitError, ChatWriteForbiddenError, UserBannedInChannelError, PeerFloodError, ChannelPrivateError, ChannelInvalidError, ChatAdminRequiredError
-from telethon.errors import FloodWaitError as FloodWaitErrorAlt, SlowModeWaitError as SlowModeWaitErrorAlt
-from telethon.tl.types import MessageMediaWebPage
+from telethon.errors import FloodWaitError as FloodWaitErrorAlt, SlowModeWaitError as SlowModeWaitErrorAlt, FileReferenceExpiredError, FileReferenceInvalidError
 from colorama import Fore, init
-from utils import match_keywords, strip_signature, highlight_keywords, escape_html
-from state_manager import get_last_read_message_id, update_last_read_message_id
+from utils import build_keyword_matcher, media_file_id
+from state_manager import open_state_backend
+from rate_limiter import build_rate_limiter, parse_rate_limits, FloodWaitDeferred, TokenBucket
+from batching import DirectSink, ForwardBatch, MAX_FORWARD_BATCH
+from dedup import build_dedup_index
+from live_queue import build_live_queue
+from session_pool import build_session_pool, resolve_session_path
+from media_cache import MediaCache
+from metrics import MetricsRegistry, build_metrics_server
+from search_scan import search_terms, search_history
+from date_index import DateIndex, DATE_INDEX_FILE
+from prefetch import HistoryPrefetcher, parse_prefetch
+from outbox import build_outbox, MessageUnavailable
+from routing import build_routing_table
+from transform import build_transform_pipeline, StageProfile
+from config_watcher import build_config_watcher
+from catch_up import build_catch_up
+from archive import ArchiveWriter, ArchiveReader, ArchiveSink, ArchivedMessage
 
 init(autoreset=True)
 
+# retrying these cannot succeed until someone fixes permissions or the source, so they dead-letter at once
+PERMANENT_ERRORS = (ChatWriteForbiddenError, UserBannedInChannelError, ChannelPrivateError, ChannelInvalidError, ChatAdminRequiredError, MessageUnavailable)
+
+# config keys a running forwarder picks up on reload; changes to any other key need a restart
+RELOADABLE_KEYS = {
+    "sources", "destinations", "routes", "keywords", "exclude_keywords", "regex_keywords", "whole_word_keywords",
+    "remove_signature", "signature_delimiters", "highlight_keywords", "bold_keywords", "append_timestamp_footer",
+    "rate_limits", "min_send_interval", "max_flood_wait", "search_scan", "search_scan_max_keywords",
+}
+
 class Forwarder:
     def __init__(self, cfg):
         self.cfg = cfg
         
-        required_fields = ["session_name", "api_id", "api_hash", "phone", "sources", "destinations"]
+        required_fields = ["session_name", "api_id", "api_hash", "phone"]
+        if not cfg.get("routes"):
+            required_fields += ["sources", "destinations"]
         for field in required_fields:
             if field not in cfg:
                 raise ValueError(f"Missing required configuration field: '{field}'")
@@ -32,41 +59,12 @@ class Forwarder:
         if not isinstance(cfg["session_name"], str) or not cfg["session_name"]:
             raise ValueError("session_name must be a non-empty string")
         
-        sname = cfg["session_name"]
-        if not os.path.isabs(sname) and not os.path.dirname(sname):
-            sname = os.path.join("data", sname)
-        dirn = os.path.dirname(sname)
-        if dirn:
-            os.makedirs(dirn, exist_ok=True)
+        sname = resolve_session_path(cfg["session_name"])
         self.client = TelegramClient(sname, cfg["api_id"], cfg["api_hash"])
         self.client.parse_mode = 'html'
         
-        if not isinstance(cfg["sources"], list):
-            raise ValueError("sources must be a list")
-        if not isinstance(cfg["destinations"], list):
-            raise ValueError("destinations must be a list")
-        
-        try:
-            self.sources = [int(x) for x in cfg["sources"]]
-        except (ValueError, TypeError) as e:
-            raise ValueError(f"Invalid source channel IDs: {e}. All source IDs must be numeric.")
-        
-        try:
-            self.destinations = [int(x) for x in cfg["destinations"]]
-        except (ValueError, TypeError) as e:
-            raise ValueError(f"Invalid destination channel IDs: {e}. All destination IDs must be numeric.")
-        
-        keywords = cfg.get("keywords", [])
-        if not isinstance(keywords, list):
-            raise ValueError("keywords must be a list")
-        self.keywords = keywords
-        
-        self.remove_signature = cfg.get("remove_signature", False)
-        
-        signature_delimiters = cfg.get("signature_delimiters", [])
-        if not isinstance(signature_delimiters, list):
-            raise ValueError("signature_delimiters must be a list")
-        self.signature_delimiters = signature_delimiters
+        self.transform_profile = StageProfile() if cfg.get("profile_transforms", False) else None
+        self._apply_rules(self._compile_rules(cfg))
         self.limit_messages = cfg.get("limit_messages", None)
         if self.limit_messages is not None and self.limit_messages < 0:
             print(Fore.YELLOW + f"Invalid limit_messages ({self.limit_messages}). Negative values are not allowed. Setting to None (scan all).")
@@ -77,21 +75,46 @@ class Forwarder:
         self.mode = cfg.get("mode", "both")
         self.show_forward_tag = cfg.get("show_forward_tag", True)
         self.resume_from_last = cfg.get("resume_from_last", False)
-        self.highlight_keywords = cfg.get("highlight_keywords", cfg.get("bold_keywords", False))
-        self.append_timestamp_footer = bool(cfg.get("append_timestamp_footer", False))
         self.id_min = cfg.get("id_min", None)
         self.id_max = cfg.get("id_max", None)
         self._dest_locks = {}
-        self.min_send_interval = 0.0
-        self._global_send_lock = asyncio.Lock()
-        self._last_send_ts = 0.0
-        self.max_flood_wait = None
-        self.caption_limit = 1024
-        
-        if not self.sources:
-            raise ValueError("At least one source channel is required")
-        if not self.destinations:
-            raise ValueError("At least one destination channel is required")
+        self.rate_limiter = build_rate_limiter(cfg)
+        self.senders = build_session_pool(cfg, self.client, self.rate_limiter, TelegramClient)
+        try:
+            self.forward_batch_size = max(1, min(int(cfg.get("forward_batch_size", MAX_FORWARD_BATCH)), MAX_FORWARD_BATCH))
+        except (ValueError, TypeError):
+            raise ValueError("forward_batch_size must be an integer")
+        try:
+            self.live_batch_window = max(0.0, float(cfg.get("live_batch_window", 0.0)))
+        except (ValueError, TypeError):
+            raise ValueError("live_batch_window must be a number")
+        self._live_sinks = {}
+        self.archive = None
+        self.dedup = build_dedup_index(cfg)
+        try:
+            media_cache_size = int(cfg.get("media_cache_size", 2048))
+        except (ValueError, TypeError):
+            raise ValueError("media_cache_size must be an integer")
+        self.media_cache = MediaCache(media_cache_size) if media_cache_size > 0 else None
+        self.metrics = MetricsRegistry()
+        self.metrics_server = build_metrics_server(cfg, self.metrics)
+        self.live_queue = build_live_queue(cfg, self._process_live, self._fetch_messages, self.metrics.queue_lag.observe)
+        self.metrics.gauge("forwarder_live_queue_depth", "Messages waiting in the live queue", lambda: self.live_queue.depth)
+        try:
+            self.backfill_concurrency = max(1, int(cfg.get("backfill_concurrency", 4)))
+        except (ValueError, TypeError):
+            print(Fore.YELLOW + "Invalid backfill_concurrency. Using 4.")
+            self.backfill_concurrency = 4
+        self.checkpoints = open_state_backend(cfg)
+        self.outbox = build_outbox(cfg)
+        if self.outbox is not None:
+            self.metrics.gauge("forwarder_outbox_pending", "Failed deliveries waiting for a retry", lambda: self.outbox.pending)
+            self.metrics.gauge("forwarder_outbox_dead_letters", "Deliveries that gave up after all retries", lambda: self.outbox.dead)
+        self.prefetch = parse_prefetch(cfg)
+        self.config_watcher = build_config_watcher(cfg, self.reload)
+        self.catch_up = build_catch_up(cfg, self)
+        self._handlers_registered = False
+        self.date_index = DateIndex(self.client, cfg.get("date_index_file", DATE_INDEX_FILE))
         if self.mode not in ("past", "live", "both", "id_range"):
             print(Fore.YELLOW + f"Invalid mode '{self.mode}', defaulting to 'both'")
             self.mode = "both"
@@ -125,8 +148,95 @@ class Forwarder:
             except ValueError:
                 print(Fore.RED + f"Invalid end_date format ({cfg['end_date']}). Ignoring date filter.")
 
+    def _compile_rules(self, cfg):
+        # the settings that can be swapped into a running forwarder by reload()
+        if not isinstance(cfg.get("sources", []), list):
+            raise ValueError("sources must be a list")
+        if not isinstance(cfg.get("destinations", []), list):
+            raise ValueError("destinations must be a list")
+        
+        try:
+            sources = [int(x) for x in cfg.get("sources", [])]
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid source channel IDs: {e}. All source IDs must be numeric.")
+        
+        try:
+            destinations = [int(x) for x in cfg.get("destinations", [])]
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid destination channel IDs: {e}. All destination IDs must be numeric.")
+        
+        matcher = build_keyword_matcher(cfg)
+        routes = build_routing_table(cfg, sources, destinations, matcher)
+        if not routes.sources:
+            raise ValueError("At least one source channel is required")
+        if not routes.destinations:
+            raise ValueError("At least one destination channel is required")
+        
+        signature_delimiters = cfg.get("signature_delimiters", [])
+        if not isinstance(signature_delimiters, list):
+            raise ValueError("signature_delimiters must be a list")
+        
+        max_flood_wait = cfg.get("max_flood_wait", 300)
+        try:
+            max_flood_wait = None if max_flood_wait is None else max(0.0, float(max_flood_wait))
+        except (ValueError, TypeError):
+            raise ValueError("max_flood_wait must be a number of seconds or null")
+        
+        terms_by_source = {}
+        if cfg.get("search_scan", False):
+            try:
+                max_terms = int(cfg.get("search_scan_max_keywords", 20))
+            except (ValueError, TypeError):
+                raise ValueError("search_scan_max_keywords must be an integer")
+            for src in routes.sources:
+                terms = search_terms([r.matcher for r in routes.routes_for(src)], max_terms)
+                if terms is not None:
+                    terms_by_source[src] = terms
+            if len(terms_by_source) < len(routes.sources):
+                print(Fore.YELLOW + f"search_scan needs whole_word_keywords, 1-{max_terms} plain keywords and no regex_keywords per source. Using a full scan for {len(routes.sources) - len(terms_by_source)} source(s).")
+        
+        return {
+            "routes": routes,
+            "sources": routes.sources,
+            "destinations": routes.destinations,
+            "pipeline": build_transform_pipeline(cfg, routes.highlight_matcher(), self.transform_profile),
+            "max_flood_wait": max_flood_wait,
+            "search_terms": terms_by_source,
+        }
+
+    def _apply_rules(self, rules):
+        # plain attribute assignments with no await in between, so no task sees a half-applied config
+        for name, value in rules.items():
+            setattr(self, name, value)
+
+    def reload(self, cfg):
+        # validate everything before touching the running instance, so a bad edit changes nothing
+        if not isinstance(cfg, dict):
+            print(Fore.RED + "Config reload rejected: the config file must contain a JSON object.")
+            return False
+        try:
+            rules = self._compile_rules(cfg)
+            limits = parse_rate_limits(cfg)
+        except ValueError as e:
+            print(Fore.RED + f"Config reload rejected: {e}")
+            return False
+        sources_changed = set(rules["sources"]) != set(self.sources)
+        self._apply_rules(rules)
+        self.rate_limiter.reconfigure(**limits)
+        if sources_changed and self._handlers_registered:
+            self.register_handlers()
+        restart_needed = sorted(k for k in set(cfg) | set(self.cfg) if k not in RELOADABLE_KEYS and cfg.get(k) != self.cfg.get(k))
+        merged = {k: v for k, v in self.cfg.items() if k not in RELOADABLE_KEYS}
+        merged.update((k, v) for k, v in cfg.items() if k in RELOADABLE_KEYS)
+        self.cfg = merged
+        print(Fore.CYAN + f"Config reloaded: {len(self.sources)} source(s), {len(self.destinations)} destination(s), {len(self.routes.routes)} route(s).")
+        if restart_needed:
+            print(Fore.YELLOW + f"Changes to {', '.join(restart_needed)} take effect after a restart.")
+        return True
+
     async def start(self):
         await self.client.start(self.cfg["phone"])
+        await self.senders.start()
 
     def _get_lock(self, dest):
         lock = self._dest_locks.get(dest)
@@ -135,27 +245,38 @@ class Forwarder:
             self._dest_locks[dest] = lock
         return lock
 
-    async def _with_retry(self, fn):
+    async def _with_retry(self, dest, fn):
         while True:
+            session = self.senders.pick(dest)
+            parked = self.rate_limiter.blocked_for(dest, session.name)
+            if self.max_flood_wait is not None and self.outbox is not None and parked > self.max_flood_wait:
+                # holding the destination lock for hours would stall its lane and the scan feeding it;
+                # without an outbox to take the send over, waiting is the only way not to lose it
+                raise FloodWaitDeferred(dest, parked)
             try:
-                async with self._global_send_lock:
-                    if self.min_send_interval > 0:
-                        now = asyncio.get_running_loop().time()
-                        if self._last_send_ts > 0:
-                            delta = now - self._last_send_ts
-                            if delta < self.min_send_interval:
-                                await asyncio.sleep(self.min_send_interval - delta)
-                res = await fn()
-                async with self._global_send_lock:
-                    self._last_send_ts = asyncio.get_running_loop().time()
+                waited = await self.rate_limiter.acquire(dest, session.name)
+                if waited:
+                    self.metrics.send_wait.inc(dest, amount=waited)
+                session.load += 1
+                started = time.perf_counter()
+                try:
+                    res = await fn(session)
+                finally:
+                    session.load -= 1
+                self.metrics.send_latency.observe(time.perf_counter() - started, dest)
+                self.rate_limiter.record_success(dest, session.name)
                 return res
             except (FloodWaitError, FloodWaitErrorAlt) as e:
                 s = getattr(e, "seconds", 0)
-                await asyncio.sleep(s + 1)
+                self.metrics.retries.inc(dest, "flood_wait")
+                self.metrics.flood_wait.inc(dest, amount=s)
+                self.rate_limiter.record_flood_wait(dest, s, session.name)
                 continue
             except (SlowModeWaitError, SlowModeWaitErrorAlt) as e:
                 s = getattr(e, "seconds", 0)
-                await asyncio.sleep(s + 1)
+                self.metrics.retries.inc(dest, "slow_mode")
+                self.metrics.flood_wait.inc(dest, amount=s)
+                self.rate_limiter.record_slow_mode(dest, s, session.name)
                 continue
             except (ChatWriteForbiddenError, UserBannedInChannelError) as e:
                 raise e
@@ -166,181 +287,538 @@ class Forwarder:
             except Exception as e:
                 raise e
 
-    async def _process_and_send(self, dest, msg):
+    async def _forward_with(self, session, dest, msgs):
+        if session.is_reader and not isinstance(msgs[0], ArchivedMessage):
+            return await session.client.forward_messages(dest, msgs)
+        return await session.client.forward_messages(dest, [m.id for m in msgs], from_peer=msgs[0].chat_id)
+
+    async def _media_for(self, session, msgs, refresh=False):
+        media = []
+        for m in msgs:
+            key = media_file_id(m)
+            cached = None
+            if self.media_cache is not None and not refresh:
+                cached = self.media_cache.get(session.name, key)
+            if cached is None:
+                own = await (session.refresh(m) if refresh else session.own_message(m))
+                cached = own.media
+            media.append(cached)
+        return media
+
+    async def _send_media_with(self, session, dest, msgs, caption=None):
+        media = await self._media_for(session, msgs)
+        try:
+            sent = await session.client.send_file(dest, media if len(media) > 1 else media[0], caption=caption)
+        except (FileReferenceExpiredError, FileReferenceInvalidError):
+            # cached or source references expire after a while; fetch fresh ones and retry once
+            if self.media_cache is not None:
+                for m in msgs:
+                    self.media_cache.invalidate(session.name, media_file_id(m))
+            media = await self._media_for(session, msgs, refresh=True)
+            sent = await session.client.send_file(dest, media if len(media) > 1 else media[0], caption=caption)
+        if self.media_cache is not None:
+            sent_list = sent if isinstance(sent, list) else [sent]
+            for m, out in zip(msgs, sent_list):
+                self.media_cache.put(session.name, media_file_id(m), out)
+        return sent
+
+    async def _process_and_send(self, dest, msg, payload=None):
         lock = self._get_lock(dest)
         async with lock:
             if self.show_forward_tag:
-                await self._with_retry(lambda: msg.forward_to(dest))
+                await self._with_retry(dest, lambda s: self._forward_with(s, dest, [msg]))
                 return "Forwarded"
+            if payload is None:
+                payload = self.pipeline.render([msg])
+            if payload.kind == "media":
+                await self._with_retry(dest, lambda s: self._send_media_with(s, dest, [msg], caption=payload.captions[0]))
+                return "Copied"
+            if payload.kind == "media_then_text":
+                await self._with_retry(dest, lambda s: self._send_media_with(s, dest, [msg]))
+                await self._with_retry(dest, lambda s: s.client.send_message(dest, payload.text))
+                return "Copied"
+            if payload.kind == "text":
+                await self._with_retry(dest, lambda s: s.client.send_message(dest, payload.text))
+                return "Copied"
+            await self._with_retry(dest, lambda s: self._forward_with(s, dest, [msg]))
+            return "Forwarded (fallback)"
+
+    async def _process_and_send_album(self, dest, msgs, payload=None):
+        lock = self._get_lock(dest)
+        async with lock:
+            if self.show_forward_tag:
+                await self._with_retry(dest, lambda s: self._forward_with(s, dest, msgs))
+                return f"Forwarded album ({len(msgs)})"
+            if payload is None:
+                payload = self.pipeline.render(msgs)
+            if payload.kind == "media_then_text":
+                await self._with_retry(dest, lambda s: self._send_media_with(s, dest, msgs))
+                await self._with_retry(dest, lambda s: s.client.send_message(dest, payload.text))
             else:
-                text = msg.text or ""
-                if self.remove_signature and text:
-                    text = strip_signature(text, self.signature_delimiters)
-                
-                if text:
-                    text = escape_html(text)
-                    if self.highlight_keywords:
-                        text = highlight_keywords(text, self.keywords)
-
-                footer = ""
-                if self.append_timestamp_footer:
-                    orig = getattr(getattr(msg, "fwd_from", None), "date", None) or msg.date
-                    if getattr(orig, "tzinfo", None) is None:
-                        orig = orig.replace(tzinfo=timezone.utc)
-                    dt_local = orig.astimezone()
-                    footer = "\n\n" + f"{dt_local.strftime('%Y-%m-%d %H:%M')}"
-
-                has_downloadable_media = bool(msg.media) and not isinstance(msg.media, MessageMediaWebPage)
-                if has_downloadable_media:
-                    cap = (text + footer) if footer else (text if text else None)
-                    if cap and len(cap) > self.caption_limit:
-                        await self._with_retry(lambda: self.client.send_file(dest, msg.media))
-                        await self._with_retry(lambda: self.client.send_message(dest, cap))
-                    else:
-                        await self._with_retry(lambda: self.client.send_file(dest, msg.media, caption=cap))
-                    return "Copied"
-                if text:
-                    final_text = text
-                    wp = getattr(msg.media, "webpage", None)
-                    url = getattr(wp, "url", None) if wp else None
-                    if url and (url not in final_text):
-                        final_text = f"{final_text}\n{url}" if final_text else url
-                    if footer:
-                        final_text = f"{final_text}{footer}"
-                    await self._with_retry(lambda: self.client.send_message(dest, final_text))
-                    return "Copied"
-                await self._with_retry(lambda: msg.forward_to(dest))
-                return "Forwarded (fallback)"
+                await self._with_retry(dest, lambda s: self._send_media_with(s, dest, msgs, caption=payload.captions))
+            return f"Copied album ({len(msgs)})"
 
-    async def forward_id_range(self):
+    def _send_unit(self, dest, unit, payload=None):
+        if len(unit) > 1:
+            return self._process_and_send_album(dest, unit, payload)
+        return self._process_and_send(dest, unit[0], payload)
+
+    async def _group_albums(self, messages):
+        album = []
+        async for msg in messages:
+            gid = getattr(msg, "grouped_id", None)
+            if album and (gid is None or gid != album[0].grouped_id):
+                yield album
+                album = []
+            if gid is None:
+                yield [msg]
+            else:
+                album.append(msg)
+        if album:
+            yield album
+
+    def stats(self):
+        return {
+            "sources": len(self.sources),
+            "forwarded": sum(v for k, v in self.metrics.sends.values.items() if k[1] == "ok"),
+            "queue_depth": self.live_queue.depth,
+            "outbox": self.outbox.pending if self.outbox is not None else 0,
+        }
+
+    def _report(self, src, dests, results, live):
+        sent = []
+        for d, res in zip(dests, results):
+            if isinstance(res, asyncio.CancelledError):
+                raise res
+            if isinstance(res, FloodWaitDeferred) and self.outbox is not None:
+                self.metrics.sends.inc(d, "deferred")
+                print(Fore.YELLOW + f"Deferred message from {src} to {d} for {res.retry_after:.0f}s: destination is parked by a flood wait")
+                continue
+            if isinstance(res, BaseException):
+                self.metrics.sends.inc(d, "error")
+                if live:
+                    print(Fore.RED + f"Error processing live to {d}: {res}")
+                else:
+                    print(Fore.RED + f"Failed to process from {src} to {d}: {res}")
+                continue
+            if live:
+                print(Fore.GREEN + f"{res} live from {src} -> {d}")
+            else:
+                print(Fore.GREEN + f"{res} message from {src} -> {d}")
+            self.metrics.sends.inc(d, "ok")
+            sent.append(d)
+        return sent
+
+    def _defer_failures(self, src, dests, results, msgs_for, kind):
+        if self.outbox is None:
+            return 0
+        deferred = 0
+        for d, res in zip(dests, results):
+            if isinstance(res, BaseException):
+                # the checkpoint moves on regardless, so the outbox keeps the failed delivery
+                delay = None
+                if isinstance(res, FloodWaitDeferred):
+                    delay = res.retry_after
+                    self.metrics.deferred.inc(d)
+                self.outbox.add(src, [m.id for m in msgs_for(d)], d, res, kind, delay=delay, dead=isinstance(res, PERMANENT_ERRORS))
+                deferred += 1
+        return deferred
+
+    async def _deliver_outbox(self, entry):
+        src = entry["source"]
+        dest = entry["destination"]
+        msgs = [m for m in await self._fetch_messages(src, entry["message_ids"]) if m is not None]
+        if not msgs:
+            raise MessageUnavailable(f"messages {entry['message_ids']} are no longer available in {src}")
+        if self.checkpoints.supports_ledger:
+            # a rescan or an earlier entry for the same messages may have delivered them already
+            msgs = [m for m in msgs if dest not in self.checkpoints.delivered(src, m.id)]
+            if not msgs:
+                return
+        if entry["kind"] == "batch":
+            res = await self._forward_batch(dest, msgs)
+        else:
+            res = await self._send_unit(dest, msgs)
+        print(Fore.GREEN + f"{res} from outbox: {src} -> {dest}")
+        self.metrics.sends.inc(dest, "ok")
+        self._record_deliveries(src, msgs, [dest])
+
+    async def replay_outbox(self, include_dead=False):
+        if self.outbox is None:
+            print(Fore.YELLOW + "The outbox is disabled in the configuration.")
+            return
+        self.checkpoints.start()
+        try:
+            ok, failed = await self.outbox.replay(self._deliver_outbox, PERMANENT_ERRORS, include_dead)
+        finally:
+            await self.client.disconnect()
+            await self.senders.disconnect()
+            await self.outbox.close()
+            await self.checkpoints.close()
+        print(Fore.CYAN + f"Outbox replay: {ok} delivered, {failed} still failing, {self.outbox.pending} pending, {self.outbox.dead} dead letters.")
+
+    async def export_archive(self, path):
+        # the usual scan for the configured mode, with matches written to the archive instead of sent
+        self.archive = ArchiveWriter(path)
+        try:
+            if self.mode == "id_range":
+                await self.forward_id_range()
+            else:
+                await self.forward_old_messages()
+        finally:
+            self.archive.close()
+            await self.client.disconnect()
+            await self.senders.disconnect()
+        print(Fore.CYAN + f"Exported {self.archive.messages} message(s) in {self.archive.records} record(s) to {path}.")
+
+    async def replay_archive(self, path, destinations=None, rate=None, start=0):
+        reader = ArchiveReader(path)
+        total = len(reader)
+        bucket = TokenBucket(rate, 1) if rate else None
+        # replaying is a deliberate re-delivery, so the dedup index from the original run must not block it;
+        # the sqlite delivery ledger still keeps a repeated replay from sending the same message twice
+        self.dedup = None
+        self.checkpoints.start()
+        done = sent = 0
+        try:
+            for src, unit in reader.units(start):
+                dests = destinations or self.routes.destinations_for(src, unit)
+                if dests:
+                    if bucket is not None:
+                        wait = bucket.reserve(time.monotonic())
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                    sent += await self._fan_out(src, unit, dests)
+                done += 1
+        finally:
+            await self.client.disconnect()
+            await self.senders.disconnect()
+            if self.outbox is not None:
+                await self.outbox.close()
+            await self.checkpoints.close()
+            print(Fore.CYAN + f"Archive replay: {done} of {max(0, total - start)} record(s), {sent} deliveries.")
+            if start + done < total:
+                print(Fore.YELLOW + f"Replay stopped early. Continue with --start {start + done}.")
+
+    def _record_deliveries(self, src, msgs, dests):
+        if self.checkpoints.supports_ledger:
+            for d in dests:
+                for m in msgs:
+                    self.checkpoints.record_delivery(src, m.id, d)
+
+    def _dedup_scope(self, dests):
+        # with several routes the same content may legitimately go to different destination sets
+        if len(self.routes.routes) < 2:
+            return None
+        return ",".join(str(d) for d in sorted(dests))
+
+    async def _fan_out(self, src, unit, dests, live=False):
+        done = set()
+        if self.checkpoints.supports_ledger:
+            # a restart after a crash mid fan-out only resends to the destinations still missing
+            done = self.checkpoints.delivered(src, unit[0].id)
+            if done:
+                dests = [d for d in dests if d not in done]
+                if not dests:
+                    return 0
+        keys = None
+        if self.dedup is not None:
+            keys = self.dedup.keys_for(src, unit, self._dedup_scope(dests))
+            if not self.dedup.claim(keys) and not done:
+                print(Fore.YELLOW + f"Skipped duplicate message {unit[0].id} from {src}")
+                return 0
+        # copy mode renders the unit once; every destination sends the same payload
+        payload = None if self.show_forward_tag else self.pipeline.render(unit)
+        try:
+            results = await asyncio.gather(
+                *(self._send_unit(d, unit, payload) for d in dests),
+                return_exceptions=True,
+            )
+        except BaseException:
+            # cancelled mid-send (Ctrl+C, SIGTERM): an unconfirmed claim would be saved and skip the message for good
+            if keys and not done:
+                self.dedup.release(keys)
+            raise
+        ok = self._report(src, dests, results, live)
+        self._record_deliveries(src, unit, ok)
+        deferred = self._defer_failures(src, dests, results, lambda d: unit, "unit")
+        if not ok and not deferred and keys and not done:
+            self.dedup.release(keys)
+        return len(ok)
+
+    async def _forward_batch(self, dest, msgs):
+        lock = self._get_lock(dest)
+        async with lock:
+            await self._with_retry(dest, lambda s: self._forward_with(s, dest, msgs))
+            return f"Forwarded batch ({len(msgs)})"
+
+    async def _fan_out_batch(self, src, msgs, dests_for, live=False):
+        done = {}
+        if self.checkpoints.supports_ledger:
+            done = {m.id: self.checkpoints.delivered(src, m.id) for m in msgs}
+        claimed = []
+        if self.dedup is not None:
+            fresh = []
+            for m in msgs:
+                keys = self.dedup.keys_for(src, [m], self._dedup_scope(dests_for[m.id]))
+                if self.dedup.claim(keys):
+                    fresh.append(m)
+                    claimed.extend(keys)
+                elif done.get(m.id):
+                    fresh.append(m)
+                else:
+                    print(Fore.YELLOW + f"Skipped duplicate message {m.id} from {src}")
+            msgs = fresh
+            if not msgs:
+                return 0
+        per_dest = {}
+        for d in self.destinations:
+            pending = [m for m in msgs if d in dests_for[m.id] and d not in done.get(m.id, ())]
+            if pending:
+                per_dest[d] = pending
+        dests = list(per_dest)
+        try:
+            results = await asyncio.gather(
+                *(self._forward_batch(d, per_dest[d]) for d in dests),
+                return_exceptions=True,
+            )
+        except BaseException:
+            if claimed:
+                self.dedup.release(claimed)
+            raise
+        ok = self._report(src, dests, results, live)
+        for d in ok:
+            self._record_deliveries(src, per_dest[d], [d])
+        deferred = self._defer_failures(src, dests, results, per_dest.get, "batch")
+        if not ok and not deferred and claimed:
+            self.dedup.release(claimed)
+        return sum(len(per_dest[d]) for d in ok)
+
+    def _source_sink(self, src, live=False):
+        if self.archive is not None:
+            return ArchiveSink(self, src, self.archive)
+        if self.show_forward_tag and self.forward_batch_size > 1:
+            if live:
+                if self.live_batch_window > 0:
+                    return ForwardBatch(self, src, self.forward_batch_size, live=True, window=self.live_batch_window)
+            else:
+                return ForwardBatch(self, src, self.forward_batch_size)
+        return DirectSink(self, src, live=live)
+
+    async def _run_sources(self, scan_source):
+        sem = asyncio.Semaphore(self.backfill_concurrency)
+
+        async def bounded(src):
+            async with sem:
+                try:
+                    return await scan_source(src)
+                except Exception as e:
+                    print(Fore.RED + f"Error accessing source {src}: {e}")
+                    return 0
+
+        results = await asyncio.gather(*(bounded(src) for src in self.sources))
+        return sum(results)
+
+    def _history(self, src, min_id=0, max_id=0):
+        return HistoryPrefetcher(self.client, src, min_id=min_id, max_id=max_id, **self.prefetch)
+
+    async def _scan_id_range_source(self, src):
         count = 0
-        for src in self.sources:
-            try:
-                min_id = (self.id_min - 1) if self.id_min is not None else None
-                max_id = (self.id_max + 1) if self.id_max is not None else None
-                had_any = False
-                async for msg in self.client.iter_messages(src, reverse=True, min_id=min_id, max_id=max_id):
-                    had_any = True
-                    for d in self.destinations:
-                        try:
-                            action = await self._process_and_send(d, msg)
-                            print(Fore.GREEN + f"{action} message from {src} -> {d}")
-                            count += 1
-                        except Exception as e:
-                            print(Fore.RED + f"Failed to process from {src} to {d}: {e}")
-                    update_last_read_message_id(src, msg.id)
-                if not had_any:
-                    print(Fore.YELLOW + f"No messages in range for source {src}")
-            except Exception as e:
-                print(Fore.RED + f"Error accessing source {src}: {e}")
+        min_id = (self.id_min - 1) if self.id_min is not None else None
+        max_id = (self.id_max + 1) if self.id_max is not None else None
+        had_any = False
+        sink = self._source_sink(src)
+        history = self._history(src, min_id, max_id)
+        try:
+            async for unit in self._group_albums(history):
+                had_any = True
+                count += await sink.push(unit, self.routes.source_destinations(src))
+        finally:
+            await history.aclose()
+        count += await sink.flush()
+        if not had_any:
+            print(Fore.YELLOW + f"No messages in range for source {src}")
+        return count
+
+    async def forward_id_range(self):
+        count = await self._run_sources(self._scan_id_range_source)
         print(Fore.CYAN + f"Processed id range messages: {count}")
 
-    async def forward_old_messages(self):
+    async def _scan_old_source(self, src):
         count = 0
-        for src in self.sources:
-            try:
-                min_id = 0
-                if self.resume_from_last:
-                    print(Fore.CYAN + f"Checking history for source {src}...")
-                    min_id = get_last_read_message_id(src)
-                    if min_id > 0:
-                        print(Fore.GREEN + f"Found last processed message ID: {min_id}. Resuming from there.")
-                    else:
-                        print(Fore.YELLOW + "No history found in state file. Scanning from beginning (or based on limit).")
-
-                use_window = (self.start_date is not None and self.end_date is not None)
-                if use_window:
-                    print(Fore.YELLOW + f"Scanning source {src} within {self.start_date} to {self.end_date}...")
-                    offset_dt = datetime(self.start_date.year, self.start_date.month, self.start_date.day, tzinfo=timezone.utc)
-                    async for msg in self.client.iter_messages(src, reverse=True, offset_date=offset_dt):
-                        d = msg.date.date()
-                        if d < self.start_date:
-                            continue
-                        if d > self.end_date:
-                            break
-
-                        text = msg.text or ""
-                        if match_keywords(text, self.keywords):
-                            for dch in self.destinations:
-                                try:
-                                    action = await self._process_and_send(dch, msg)
-                                    print(Fore.GREEN + f"{action} message from {src} -> {dch}")
-                                    count += 1
-                                except Exception as e:
-                                    print(Fore.RED + f"Failed to process from {src} to {dch}: {e}")
-                        update_last_read_message_id(src, msg.id)
+        min_id = 0
+        if self.resume_from_last:
+            print(Fore.CYAN + f"Checking history for source {src}...")
+            min_id = self.checkpoints.get(src)
+            if min_id > 0:
+                print(Fore.GREEN + f"Found last processed message ID: {min_id}. Resuming from there.")
+            else:
+                print(Fore.YELLOW + "No history found in state file. Scanning from beginning (or based on limit).")
+
+        max_id = 0
+        if self.start_date or self.end_date:
+            # date filters become an id range, so nothing outside the window is downloaded
+            date_min, max_id = await self.date_index.bounds(src, self.start_date, self.end_date)
+            min_id = max(min_id, date_min)
+            if max_id and min_id >= max_id - 1:
+                print(Fore.YELLOW + f"No messages within {self.start_date or '...'} to {self.end_date or '...'} in source {src}")
+                return 0
+
+        if src in self.search_terms and (self.scan_all or not self.limit_messages):
+            return await self._scan_search_source(src, min_id, max_id)
+
+        limit = self.limit_messages
+        if self.scan_all or (limit is None) or (limit == 0):
+            limit = None
+        if self.start_date or self.end_date:
+            print(Fore.YELLOW + f"Scanning source {src} within {self.start_date or '...'} to {self.end_date or '...'} (IDs {min_id + 1} to {max_id - 1 if max_id else 'latest'}, Limit: {limit if limit else 'All'})...")
+        elif min_id > 0:
+            print(Fore.YELLOW + f"Scanning source {src} starting after ID {min_id} (Limit: {limit if limit else 'All'})...")
+        else:
+            print(Fore.YELLOW + f"Scanning source {src} (Limit: {limit if limit else 'All'})...")
+        processed = 0
+        had_any = False
+        sink = self._source_sink(src)
+        history = self._history(src, min_id, max_id)
+        try:
+            async for unit in self._group_albums(history):
+                had_any = True
+                d = unit[0].date.date()
+                if self.start_date and d < self.start_date:
                     continue
-                limit = self.limit_messages
-                if self.scan_all or (limit is None) or (limit == 0):
-                    limit = None
-                if min_id > 0:
-                    print(Fore.YELLOW + f"Scanning source {src} starting after ID {min_id} (Limit: {limit if limit else 'All'})...")
-                else:
-                    print(Fore.YELLOW + f"Scanning source {src} (Limit: {limit if limit else 'All'})...")
-                processed = 0
-                had_any = False
-                async for msg in self.client.iter_messages(src, reverse=True, min_id=min_id):
-                    had_any = True
-                    if self.start_date and msg.date.date() < self.start_date:
-                        continue
-                    if self.end_date and msg.date.date() > self.end_date:
-                        continue
-
-                    text = msg.text or ""
-                    if match_keywords(text, self.keywords):
-                        for d in self.destinations:
-                            try:
-                                action = await self._process_and_send(d, msg)
-                                print(Fore.GREEN + f"{action} message from {src} -> {d}")
-                                count += 1
-                            except Exception as e:
-                                print(Fore.RED + f"Failed to process from {src} to {d}: {e}")
-
-                    update_last_read_message_id(src, msg.id)
-                    if limit is not None:
-                        processed += 1
-                        if processed >= limit:
-                            break
-                if not had_any:
-                    print(Fore.YELLOW + f"No new messages found in source {src}")
+                if self.end_date and d > self.end_date:
+                    break
 
-            except Exception as e:
-                print(Fore.RED + f"Error accessing source {src}: {e}")
-                            
+                count += await sink.push(unit, self.routes.destinations_for(src, unit))
+                if limit is not None:
+                    processed += len(unit)
+                    if processed >= limit:
+                        break
+        finally:
+            await history.aclose()
+        count += await sink.flush()
+        if not had_any:
+            print(Fore.YELLOW + f"No new messages found in source {src}")
+        return count
+
+    async def _scan_search_source(self, src, min_id, max_id=0):
+        latest = await self.client.get_messages(src, limit=1)
+        if not latest:
+            print(Fore.YELLOW + f"No new messages found in source {src}")
+            return 0
+        top_id = latest[0].id
+        max_id = min(max_id, top_id + 1) if max_id else top_id + 1
+        terms = self.search_terms[src]
+        print(Fore.YELLOW + f"Searching source {src} for {len(terms)} keyword(s) after ID {min_id}...")
+        count = 0
+        sink = self._source_sink(src)
+        # the server narrows the candidates; the local matcher still decides what is forwarded
+        async for unit in search_history(self.client, src, terms, min_id, max_id):
+            d = unit[0].date.date()
+            if self.start_date and d < self.start_date:
+                continue
+            if self.end_date and d > self.end_date:
+                break
+            count += await sink.push(unit, self.routes.destinations_for(src, unit))
+        count += await sink.flush()
+        if not self.end_date and self.archive is None:
+            # everything up to top_id that search skipped is a non-match, so resume can start past it
+            self.checkpoints.update(src, top_id)
+        return count
+
+    async def forward_old_messages(self):
+        count = await self._run_sources(self._scan_old_source)
         print(Fore.CYAN + f"Processed old messages: {count}")
 
+    def _live_destinations(self, src_id, unit):
+        msg = unit[0]
+        dests = ()
+        within_date = True
+        if self.start_date and msg.date.date() < self.start_date:
+            within_date = False
+        if self.end_date and msg.date.date() > self.end_date:
+            within_date = False
+
+        if within_date and self.mode in ("live", "past", "both"):
+            dests = self.routes.destinations_for(src_id, unit)
+        return dests
+
+    async def _handle_live(self, src_id, unit):
+        if self.catch_up is not None and not self.catch_up.observe(src_id, unit):
+            return
+        await self.live_queue.put(src_id, unit, self._live_destinations(src_id, unit))
+
+    async def _process_live(self, src_id, unit, dests):
+        sink = self._live_sinks.get(src_id)
+        if sink is None:
+            sink = self._source_sink(src_id, live=True)
+            self._live_sinks[src_id] = sink
+        await sink.push(unit, dests)
+
+    async def _fetch_messages(self, src_id, ids):
+        return await self.client.get_messages(src_id, ids=ids)
+
+    async def _on_new_message(self, event):
+        msg = event.message
+        if getattr(msg, "grouped_id", None):
+            # album parts are delivered together by the Album handler
+            return
+        await self._handle_live(event.chat_id, [msg])
+
+    async def _on_album(self, event):
+        await self._handle_live(event.chat_id, list(event.messages))
+
     def register_handlers(self):
-        @self.client.on(events.NewMessage(chats=self.sources))
-        async def handler(event):
-            msg = event.message
-            text = msg.text or ""
-            src_id = event.chat_id
-            
-            should_forward = False
-            within_date = True
-            if self.start_date and msg.date.date() < self.start_date:
-                within_date = False
-            if self.end_date and msg.date.date() > self.end_date:
-                within_date = False
-            
-            if self.mode == "live":
-                if match_keywords(text, self.keywords):
-                    should_forward = True
-            elif self.mode in ("past", "both"):
-                if match_keywords(text, self.keywords):
-                    should_forward = True
-            
-            if should_forward and within_date:
-                for d in self.destinations:
-                    try:
-                        action = await self._process_and_send(d, msg)
-                        print(Fore.GREEN + f"{action} live from {src_id} -> {d}")
-                    except Exception as e:
-                        print(Fore.RED + f"Error processing live to {d}: {e}")
-            
-            update_last_read_message_id(src_id, msg.id)
+        # called again after a reload changes the sources; only the chat filters are replaced,
+        # the connection stays up
+        self.client.remove_event_handler(self._on_new_message)
+        self.client.remove_event_handler(self._on_album)
+        self.client.add_event_handler(self._on_new_message, events.NewMessage(chats=self.sources))
+        self.client.add_event_handler(self._on_album, events.Album(chats=self.sources))
+        self._handlers_registered = True
 
     async def run(self):
+        self.checkpoints.start()
+        if self.dedup is not None:
+            self.dedup.start()
+        await self.metrics_server.start()
+        if self.outbox is not None:
+            self.outbox.start(self._deliver_outbox, PERMANENT_ERRORS)
+        if self.config_watcher is not None:
+            self.config_watcher.start()
+        try:
+            await self._run_mode()
+        finally:
+            if self.config_watcher is not None:
+                await self.config_watcher.close()
+            if self.catch_up is not None:
+                await self.catch_up.close()
+            await self.live_queue.close()
+            # pending live batches still need the sender clients, so they go out before those disconnect
+            for sink in list(self._live_sinks.values()):
+                try:
+                    await sink.flush()
+                except Exception as e:
+                    print(Fore.RED + f"Error flushing pending live messages: {e}")
+            await self.senders.disconnect()
+            await self.metrics_server.close()
+            if self.transform_profile is not None and self.transform_profile.seconds:
+                print(Fore.CYAN + "Transform stage timings:")
+                for line in self.transform_profile.report():
+                    print(Fore.CYAN + f"  {line}")
+            waited = sorted(self.metrics.send_wait.values.items(), key=lambda kv: -kv[1])
+            if waited and waited[0][1] >= 1:
+                top = ", ".join(f"{k[0]}: {v:.0f}s" for k, v in waited[:5])
+                print(Fore.CYAN + f"Sends spent {self.metrics.send_wait.total():.0f}s paused by rate limits and flood waits ({top}).")
+            if self.outbox is not None:
+                if self.outbox.pending:
+                    print(Fore.YELLOW + f"{self.outbox.pending} failed deliveries are waiting in the outbox. Run 'python main.py --replay-outbox' to retry them now.")
+                await self.outbox.close()
+            if self.dedup is not None:
+                await self.dedup.close()
+            await self.checkpoints.close()
+
+    async def _run_mode(self):
         if self.mode == "past":
             if self.cfg.get("scan_old", False):
                 await self.forward_old_messages()
@@ -358,6 +836,10 @@ class Forwarder:
             await self.forward_id_range()
             await self.client.disconnect()
             return
+        self.live_queue.start()
+        if self.catch_up is not None:
+            # reads the stored checkpoints, so it has to start before live messages move them
+            self.catch_up.start()
         self.register_handlers()
         print(Fore.GREEN + "Listening for new messages...")
         await self.client.run_until_disconnected()
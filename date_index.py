@@ -0,0 +1,55 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from state_manager import DATA_DIR, save_state
+
+DATE_INDEX_FILE = os.path.join(DATA_DIR, "date_index.json")
+
+def _midnight(day):
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+class DateIndex:
+    """Maps calendar days to message ids per source so date filters become id ranges."""
+
+    def __init__(self, client, path=DATE_INDEX_FILE):
+        self.client = client
+        self.path = path
+        self.lookups = 0
+        self._entries = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading date index: {e}")
+            return {}
+
+    async def id_before(self, src, day):
+        # ids grow with time, so the newest message dated before midnight bounds every later one
+        key = f"{src}:{day.isoformat()}"
+        cached = self._entries.get(key)
+        if cached is not None:
+            return cached
+        boundary = _midnight(day)
+        self.lookups += 1
+        found = await self.client.get_messages(src, limit=1, offset_date=boundary)
+        msg_id = found[0].id if found else 0
+        if boundary <= datetime.now(timezone.utc):
+            # later days can still gain messages, so only past boundaries are stable enough to keep
+            self._entries[key] = msg_id
+            save_state(self._entries, self.path, indent=None)
+        return msg_id
+
+    async def bounds(self, src, start_date=None, end_date=None):
+        min_id = 0
+        max_id = 0
+        if start_date is not None:
+            min_id = await self.id_before(src, start_date)
+        if end_date is not None:
+            next_day = end_date + timedelta(days=1)
+            if _midnight(next_day) <= datetime.now(timezone.utc):
+                max_id = await self.id_before(src, next_day) + 1
+        return min_id, max_id
@@ -0,0 +1,155 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from state_manager import DATA_DIR, save_state
+from utils import media_file_id
+
+DEDUP_FILE = os.path.join(DATA_DIR, "dedup_index.json")
+
+_whitespace = re.compile(r"\s+")
+
+def content_fingerprint(unit):
+    parts = []
+    for msg in unit:
+        text = msg.text or ""
+        if text:
+            parts.append(_whitespace.sub(" ", text.casefold()).strip())
+        fid = media_file_id(msg)
+        if fid:
+            parts.append(fid)
+    if not parts:
+        return None
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+class DedupIndex:
+    def __init__(self, path=DEDUP_FILE, ttl=72 * 3600, max_entries=100000, content=True, flush_interval=30.0):
+        self.path = path
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self.content = content
+        self.flush_interval = float(flush_interval)
+        self._entries = OrderedDict()
+        self._dirty = False
+        self._write_lock = threading.Lock()
+        self._task = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Error loading dedup index: {e}")
+            return
+        now = time.time()
+        for key, expiry in data.get("entries", []):
+            if expiry > now:
+                self._entries[key] = expiry
+        self._evict(now)
+
+    def _evict(self, now):
+        while self._entries:
+            key, expiry = next(iter(self._entries.items()))
+            if expiry > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+            self._dirty = True
+
+    def keys_for(self, src, unit, scope=None):
+        keys = [f"id:{src}:{m.id}" for m in unit]
+        if self.content:
+            fp = content_fingerprint(unit)
+            if fp:
+                keys.append(f"fp:{scope}:{fp}" if scope else f"fp:{fp}")
+        return keys
+
+    def _seen(self, key, now):
+        expiry = self._entries.get(key)
+        if expiry is None:
+            return False
+        if expiry <= now:
+            del self._entries[key]
+            self._dirty = True
+            return False
+        self._entries.move_to_end(key)
+        return True
+
+    def claim(self, keys):
+        now = time.time()
+        if any(self._seen(k, now) for k in keys):
+            return False
+        expiry = now + self.ttl
+        for k in keys:
+            self._entries[k] = expiry
+        self._dirty = True
+        self._evict(now)
+        return True
+
+    def release(self, keys):
+        for k in keys:
+            if self._entries.pop(k, None) is not None:
+                self._dirty = True
+
+    def _snapshot(self):
+        self._dirty = False
+        return {"entries": [[k, v] for k, v in self._entries.items()]}
+
+    def _write(self, snapshot):
+        with self._write_lock:
+            save_state(snapshot, self.path, indent=None)
+
+    def flush(self):
+        if self._dirty:
+            self._write(self._snapshot())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._dirty:
+                await loop.run_in_executor(None, self._write, self._snapshot())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            atexit.register(self.flush)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+def build_dedup_index(cfg):
+    raw = cfg.get("dedup", {})
+    if raw is False:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("dedup must be an object or false")
+    if not raw.get("enabled", True):
+        return None
+    try:
+        ttl = float(raw.get("ttl_hours", 72)) * 3600
+        max_entries = int(raw.get("max_entries", 100000))
+    except (ValueError, TypeError):
+        raise ValueError("dedup.ttl_hours and dedup.max_entries must be numbers")
+    if ttl <= 0 or max_entries <= 0:
+        raise ValueError("dedup.ttl_hours and dedup.max_entries must be positive")
+    return DedupIndex(
+        path=raw.get("path", DEDUP_FILE),
+        ttl=ttl,
+        max_entries=max_entries,
+        content=bool(raw.get("content", True)),
+    )
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+from colorama import Fore
+from state_manager import DATA_DIR
+
+SPILL_FILE = os.path.join(DATA_DIR, "live_spill.jsonl")
+OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+
+class LiveQueue:
+    def __init__(self, handler, fetch, lag_observer=None, maxsize=1000, workers=4, overflow="block", spill_file=SPILL_FILE, report_interval=60.0):
+        self.handler = handler
+        self.fetch = fetch
+        self.lag_observer = lag_observer
+        self.maxsize = max(1, int(maxsize))
+        self.workers = max(1, int(workers))
+        self.overflow = overflow
+        self.spill_file = spill_file
+        self.report_interval = float(report_interval)
+        self._queue = asyncio.Queue(self.maxsize)
+        self._source_locks = {}
+        self._tasks = []
+        self._spill_pending = 0
+        self._spill_offset = 0
+        self._spill_ready = asyncio.Event()
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize() + self._spill_pending
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+        }
+
+    async def put(self, src, unit, dests):
+        loop = asyncio.get_running_loop()
+        item = (src, unit, dests, loop.time())
+        self.enqueued += 1
+        if self.overflow == "spill" and (self._spill_pending or self._queue.full()):
+            # once anything is on disk, newer items follow it there so FIFO order holds
+            self._spill(src, unit, dests)
+        elif self.overflow == "drop_oldest" and self._queue.full():
+            old = self._queue.get_nowait()
+            self._queue.task_done()
+            self.dropped += 1
+            print(Fore.YELLOW + f"Live queue full, dropped message {old[1][0].id} from {old[0]}")
+            self._queue.put_nowait(item)
+        else:
+            await self._queue.put(item)
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def _spill(self, src, unit, dests):
+        os.makedirs(os.path.dirname(self.spill_file) or ".", exist_ok=True)
+        with open(self.spill_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"src": src, "ids": [m.id for m in unit], "dests": dests}) + "\n")
+        self._spill_pending += 1
+        self.spilled += 1
+        self._spill_ready.set()
+
+    def _read_spilled(self):
+        with open(self.spill_file, "r", encoding="utf-8") as f:
+            f.seek(self._spill_offset)
+            line = f.readline()
+            self._spill_offset = f.tell()
+        return json.loads(line)
+
+    async def _drain_spill(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._spill_ready.wait()
+            while self._spill_pending:
+                entry = self._read_spilled()
+                try:
+                    msgs = await self.fetch(entry["src"], entry["ids"])
+                except Exception as e:
+                    print(Fore.RED + f"Failed to reload spilled messages from {entry['src']}: {e}")
+                    msgs = []
+                msgs = [m for m in msgs if m is not None]
+                if msgs:
+                    await self._queue.put((entry["src"], msgs, entry["dests"], loop.time()))
+                self._spill_pending -= 1
+            self._spill_ready.clear()
+            self._spill_offset = 0
+            try:
+                os.remove(self.spill_file)
+            except OSError:
+                pass
+
+    async def _worker(self):
+        while True:
+            src, unit, dests, enqueued_at = await self._queue.get()
+            if self.lag_observer is not None:
+                self.lag_observer(asyncio.get_running_loop().time() - enqueued_at)
+            lock = self._source_locks.get(src)
+            if lock is None:
+                lock = asyncio.Lock()
+                self._source_locks[src] = lock
+            try:
+                # items are taken in FIFO order and the lock is FIFO too, so each source stays ordered
+                async with lock:
+                    await self.handler(src, unit, dests)
+            except Exception as e:
+                print(Fore.RED + f"Error processing live message from {src}: {e}")
+            finally:
+                self.processed += 1
+                self._queue.task_done()
+
+    async def _report(self):
+        last = None
+        while True:
+            await asyncio.sleep(self.report_interval)
+            stats = self.stats()
+            if stats != last:
+                print(Fore.CYAN + "Live queue: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+                last = stats
+
+    def start(self):
+        if self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        if self.overflow == "spill":
+            if os.path.exists(self.spill_file):
+                os.remove(self.spill_file)
+            self._tasks.append(loop.create_task(self._drain_spill()))
+        if self.report_interval > 0:
+            self._tasks.append(loop.create_task(self._report()))
+
+    async def close(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+def build_live_queue(cfg, handler, fetch, lag_observer=None):
+    raw = cfg.get("live_queue", {})
+    if not isinstance(raw, dict):
+        raise ValueError("live_queue must be an object")
+    overflow = raw.get("overflow", "block")
+    if overflow not in OVERFLOW_POLICIES:
+        raise ValueError(f"live_queue.overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+    try:
+        maxsize = int(raw.get("maxsize", 1000))
+        workers = int(raw.get("workers", 4))
+        report_interval = float(raw.get("report_interval", 60))
+    except (ValueError, TypeError):
+        raise ValueError("live_queue.maxsize, workers and report_interval must be numbers")
+    if maxsize <= 0 or workers <= 0:
+        raise ValueError("live_queue.maxsize and live_queue.workers must be positive")
+    return LiveQueue(
+        handler,
+        fetch,
+        lag_observer,
+        maxsize=maxsize,
+        workers=workers,
+        overflow=overflow,
+        spill_file=raw.get("spill_file", SPILL_FILE),
+        report_interval=report_interval,
+    )
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import os
 from config_manager import load_config, save_config
@@ -134,6 +135,42 @@ def request_config():
     save_config(cfg)
     return cfg
 
+async def replay_outbox(include_dead=False):
+    cfg = load_config()
+    if cfg is None:
+        print("No configuration found. Run 'python main.py' once to create it.")
+        return
+    try:
+        fwd = Forwarder(cfg)
+        await fwd.start()
+        await fwd.replay_outbox(include_dead)
+    except ValueError as e:
+        print(f"Configuration error: {e}")
+
+async def export_archive(path):
+    cfg = load_config()
+    if cfg is None:
+        print("No configuration found. Run 'python main.py' once to create it.")
+        return
+    try:
+        fwd = Forwarder(cfg)
+        await fwd.start()
+        await fwd.export_archive(path)
+    except ValueError as e:
+        print(f"Configuration error: {e}")
+
+async def replay_archive(path, destinations=None, rate=None, start=0):
+    cfg = load_config()
+    if cfg is None:
+        print("No configuration found. Run 'python main.py' once to create it.")
+        return
+    try:
+        fwd = Forwarder(cfg)
+        await fwd.start()
+        await fwd.replay_archive(path, destinations, rate, start)
+    except ValueError as e:
+        print(f"Error: {e}")
+
 async def start_loop():
     cfg = load_config()
     if cfg is None:
@@ -179,5 +216,26 @@ async def start_loop():
         print(f"Unexpected error: {e}")
         raise
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Forward messages between Telegram channels.")
+    parser.add_argument("--replay-outbox", action="store_true", help="retry every delivery waiting in the outbox once, then exit")
+    parser.add_argument("--include-dead-letters", action="store_true", help="with --replay-outbox, also retry deliveries that already gave up")
+    parser.add_argument("--export", metavar="FILE", help="scan history as configured and write the matching messages to an archive file instead of sending them")
+    parser.add_argument("--replay-archive", metavar="FILE", help="send the messages in an archive file, then exit")
+    parser.add_argument("--to", type=int, nargs="+", metavar="ID", help="with --replay-archive, send everything to these destinations instead of routing it by the config")
+    parser.add_argument("--rate", type=float, help="with --replay-archive, send at most this many messages per second (an album counts once)")
+    parser.add_argument("--start", type=int, default=0, help="with --replay-archive, skip this many records")
+    args = parser.parse_args(argv)
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.replay_outbox:
+        asyncio.run(replay_outbox(args.include_dead_letters))
+    elif args.export:
+        asyncio.run(export_archive(args.export))
+    elif args.replay_archive:
+        asyncio.run(replay_archive(args.replay_archive, args.to, args.rate, max(0, args.start)))
+    else:
+        asyncio.run(start_loop())
+
 if __name__ == "__main__":
-    asyncio.run(start_loop())
+    main()
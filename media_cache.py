@@ -0,0 +1,38 @@
+from collections import OrderedDict
+from telethon import utils as tl_utils
+
+class MediaCache:
+    def __init__(self, max_entries=2048):
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, account, key):
+        if key is None:
+            return None
+        media = self._entries.get((account, key))
+        if media is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((account, key))
+        self.hits += 1
+        return media
+
+    def put(self, account, key, sent):
+        media = getattr(sent, "media", None)
+        if key is None or media is None:
+            return
+        try:
+            # the sent copy belongs to the sending account, so its reference can be reused
+            # for every later destination without re-resolving the source message
+            input_media = tl_utils.get_input_media(media)
+        except TypeError:
+            return
+        self._entries[(account, key)] = input_media
+        self._entries.move_to_end((account, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, account, key):
+        self._entries.pop((account, key), None)
@@ -0,0 +1,220 @@
+import asyncio
+import bisect
+import time
+from colorama import Fore
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def render(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def render(self):
+        yield f"{self.name} {self.fn()}"
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            # per-bucket counts plus +Inf, then sum and count
+            series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self.series[labels] = series
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, q):
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0
+        for series in self.series.values():
+            for i, c in enumerate(series[0]):
+                counts[i] += c
+            total += series[2]
+        if not total:
+            return None
+        target = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def render(self):
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.started = time.monotonic()
+        self.messages = self.counter("forwarder_messages_total", "Messages read from sources", ("source", "matched"))
+        self.sends = self.counter("forwarder_sends_total", "Deliveries per destination by result", ("destination", "result"))
+        self.retries = self.counter("forwarder_retries_total", "Send retries by reason", ("destination", "reason"))
+        self.flood_wait = self.counter("forwarder_flood_wait_seconds_total", "Seconds of FloodWait/SlowMode requested by Telegram", ("destination",))
+        self.send_wait = self.counter("forwarder_send_wait_seconds_total", "Seconds sends spent paused by rate limits and flood waits", ("destination",))
+        self.caught_up = self.counter("forwarder_catch_up_total", "Missed messages backfilled after startup or a reconnect", ("source",))
+        self.deferred = self.counter("forwarder_deferred_total", "Deliveries handed to the outbox because the destination was parked", ("destination",))
+        self.send_latency = self.histogram("forwarder_send_latency_seconds", "Latency of individual send requests", ("destination",))
+        self.queue_lag = self.histogram("forwarder_live_queue_lag_seconds", "Time live messages spent queued before processing")
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, fn):
+        metric = Gauge(name, help_text, fn)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self, previous):
+        scanned = self.messages.total()
+        matched = sum(v for k, v in self.messages.values.items() if k[1] == "yes")
+        ok = sum(v for k, v in self.sends.values.items() if k[1] == "ok")
+        failed = sum(v for k, v in self.sends.values.items() if k[1] == "error")
+        now = time.monotonic()
+        elapsed = max(1e-9, now - previous.get("time", self.started))
+        rate = (scanned - previous.get("scanned", 0)) / elapsed
+        p50 = self.send_latency.quantile(0.5)
+        p99 = self.send_latency.quantile(0.99)
+        line = (
+            f"{rate:.1f} msg/s, scanned={scanned}, matched={matched} "
+            f"({(matched / scanned * 100) if scanned else 0:.1f}%), sent={ok}, failed={failed}, "
+            f"retries={self.retries.total()}, flood_wait={self.flood_wait.total():.0f}s, "
+            f"waited={self.send_wait.total():.0f}s, deferred={self.deferred.total()}, "
+            f"send_p50<={p50 if p50 is not None else '-'}s, send_p99<={p99 if p99 is not None else '-'}s"
+        )
+        return line, {"time": now, "scanned": scanned}
+
+class MetricsServer:
+    def __init__(self, registry, host="127.0.0.1", port=0, summary_interval=60.0):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.summary_interval = summary_interval
+        self._server = None
+        self._task = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                body = self.registry.render().encode("utf-8")
+                status = "200 OK"
+                ctype = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body = b"Not Found\n"
+                status = "404 Not Found"
+                ctype = "text/plain"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _summarize(self):
+        previous = {}
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            line, previous = self.registry.summary(previous)
+            print(Fore.CYAN + "Stats: " + line)
+
+    async def start(self):
+        if self.port:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            print(Fore.GREEN + f"Metrics available at http://{self.host}:{self.port}/metrics")
+        if self.summary_interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._summarize())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+def build_metrics_server(cfg, registry):
+    raw = cfg.get("metrics", {})
+    if not isinstance(raw, dict):
+        raise ValueError("metrics must be an object")
+    try:
+        port = int(raw.get("port", 0) or 0)
+        summary_interval = float(raw.get("summary_interval", 60))
+    except (ValueError, TypeError):
+        raise ValueError("metrics.port and metrics.summary_interval must be numbers")
+    if not 0 <= port <= 65535:
+        raise ValueError("metrics.port must be between 0 and 65535")
+    return MetricsServer(registry, raw.get("host", "127.0.0.1"), port, summary_interval)
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from colorama import Fore
+from state_manager import DATA_DIR
+
+OUTBOX_DB = os.path.join(DATA_DIR, "outbox.db")
+
+class MessageUnavailable(Exception):
+    """The source messages of an outbox entry were deleted or can no longer be read."""
+
+_COLUMNS = "id, source_id, message_ids, destination, kind, attempts, next_attempt, last_error, created_at"
+
+def _entry(row):
+    return {
+        "id": row[0],
+        "source": int(row[1]),
+        "message_ids": json.loads(row[2]),
+        "destination": int(row[3]),
+        "kind": row[4],
+        "attempts": row[5],
+        "next_attempt": row[6],
+        "last_error": row[7],
+        "created_at": row[8],
+    }
+
+class Outbox:
+    """Durable queue of failed deliveries, retried with exponential backoff until they succeed or dead-letter."""
+
+    def __init__(self, path=OUTBOX_DB, max_attempts=8, base_delay=30.0, max_delay=3600.0, poll_interval=5.0):
+        self.path = path
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.poll_interval = float(poll_interval)
+        dirn = os.path.dirname(path)
+        if dirn:
+            os.makedirs(dirn, exist_ok=True)
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for table in ("outbox", "dead_letters"):
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, source_id TEXT NOT NULL, message_ids TEXT NOT NULL, "
+                "destination TEXT NOT NULL, kind TEXT NOT NULL, attempts INTEGER NOT NULL, "
+                "next_attempt REAL NOT NULL, last_error TEXT, created_at REAL NOT NULL)"
+            )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt)")
+        self.pending = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self.dead = self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        self.retried = 0
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    def backoff(self, attempts):
+        return min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+
+    def add(self, src, msg_ids, dest, error, kind="unit", delay=None, dead=False):
+        # the failed send that lands here counts as the first attempt
+        now = time.time()
+        table = "dead_letters" if dead else "outbox"
+        self._conn.execute(
+            f"INSERT INTO {table} (source_id, message_ids, destination, kind, attempts, next_attempt, last_error, created_at) "
+            "VALUES (?, ?, ?, ?, 1, ?, ?, ?)",
+            (str(src), json.dumps(list(msg_ids)), str(dest), kind, now + (self.backoff(1) if delay is None else delay), str(error), now),
+        )
+        if dead:
+            self.dead += 1
+            return
+        self.pending += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def due(self, now=None, limit=50):
+        now = time.time() if now is None else now
+        rows = self._conn.execute(
+            f"SELECT {_COLUMNS} FROM outbox WHERE next_attempt <= ? ORDER BY next_attempt, id LIMIT ?", (now, limit)
+        ).fetchall()
+        return [_entry(r) for r in rows]
+
+    def next_due(self):
+        row = self._conn.execute("SELECT MIN(next_attempt) FROM outbox").fetchone()
+        return row[0]
+
+    def succeeded(self, entry):
+        self._conn.execute("DELETE FROM outbox WHERE id = ?", (entry["id"],))
+        self.pending -= 1
+
+    def postpone(self, entry, seconds, error):
+        # the destination asked for a pause, which is not a failed attempt
+        self._conn.execute(
+            "UPDATE outbox SET next_attempt = ?, last_error = ? WHERE id = ?",
+            (time.time() + seconds, str(error), entry["id"]),
+        )
+
+    def failed(self, entry, error, permanent=False):
+        attempts = entry["attempts"] + 1
+        if permanent or attempts >= self.max_attempts:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO dead_letters (source_id, message_ids, destination, kind, attempts, next_attempt, last_error, created_at) "
+                "SELECT source_id, message_ids, destination, kind, ?, ?, ?, created_at FROM outbox WHERE id = ?",
+                (attempts, time.time(), str(error), entry["id"]),
+            )
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (entry["id"],))
+            self._conn.execute("COMMIT")
+            self.pending -= 1
+            self.dead += 1
+            return True
+        self._conn.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+            (attempts, time.time() + self.backoff(attempts), str(error), entry["id"]),
+        )
+        return False
+
+    def requeue_dead_letters(self):
+        self._conn.execute("BEGIN")
+        moved = self._conn.execute(
+            "INSERT INTO outbox (source_id, message_ids, destination, kind, attempts, next_attempt, last_error, created_at) "
+            "SELECT source_id, message_ids, destination, kind, 0, ?, last_error, created_at FROM dead_letters",
+            (time.time(),),
+        ).rowcount
+        self._conn.execute("DELETE FROM dead_letters")
+        self._conn.execute("COMMIT")
+        self.pending += moved
+        self.dead = 0
+        return moved
+
+    async def _attempt(self, entry, deliver, permanent):
+        try:
+            await deliver(entry)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                self.postpone(entry, retry_after, e)
+                return False
+            dead = self.failed(entry, e, isinstance(e, permanent))
+            if dead:
+                print(Fore.RED + f"Moved delivery of {entry['message_ids']} from {entry['source']} to {entry['destination']} to dead letters: {e}")
+            else:
+                print(Fore.YELLOW + f"Retry {entry['attempts']} of {entry['message_ids']} from {entry['source']} to {entry['destination']} failed: {e}")
+            return False
+        self.succeeded(entry)
+        self.retried += 1
+        return True
+
+    async def _run(self, deliver, permanent):
+        while not self._stopping:
+            for entry in self.due():
+                await self._attempt(entry, deliver, permanent)
+            nxt = self.next_due()
+            timeout = self.poll_interval if nxt is None else min(self.poll_interval, nxt - time.time())
+            if timeout <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self, deliver, permanent=()):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run(deliver, permanent))
+
+    async def replay(self, deliver, permanent=(), include_dead=False):
+        if include_dead:
+            self.requeue_dead_letters()
+        # every entry gets exactly one attempt now, regardless of its backoff
+        ok = failed = 0
+        last_id = 0
+        while True:
+            rows = self._conn.execute(f"SELECT {_COLUMNS} FROM outbox WHERE id > ? ORDER BY id LIMIT 50", (last_id,)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                entry = _entry(row)
+                last_id = entry["id"]
+                if await self._attempt(entry, deliver, permanent):
+                    ok += 1
+                else:
+                    failed += 1
+        return ok, failed
+
+    async def close(self):
+        if self._task is not None:
+            # wait_for can swallow a cancel that races with the wakeup, so the loop also checks a flag
+            self._stopping = True
+            self._wakeup.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        self._conn.close()
+
+def build_outbox(cfg):
+    raw = cfg.get("outbox", {})
+    if raw is False:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("outbox must be an object or false")
+    if not raw.get("enabled", True):
+        return None
+    try:
+        max_attempts = int(raw.get("max_attempts", 8))
+        base_delay = float(raw.get("base_delay", 30))
+        max_delay = float(raw.get("max_delay", 3600))
+    except (ValueError, TypeError):
+        raise ValueError("outbox.max_attempts, base_delay and max_delay must be numbers")
+    if max_attempts <= 0 or base_delay < 0 or max_delay < base_delay:
+        raise ValueError("outbox.max_attempts must be positive and 0 <= base_delay <= max_delay")
+    return Outbox(raw.get("path", OUTBOX_DB), max_attempts, base_delay, max_delay)
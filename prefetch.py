@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+# getHistory returns at most 100 messages per request
+MAX_PAGE_SIZE = 100
+
+class HistoryPrefetcher:
+    """Reads history pages ahead of the consumer so fetching overlaps with sending."""
+
+    def __init__(self, client, src, page_size=MAX_PAGE_SIZE, read_ahead=2, wait_time=1.0, min_id=0, max_id=0):
+        self.client = client
+        self.src = src
+        self.page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        self.wait_time = max(0.0, float(wait_time))
+        self.min_id = min_id or 0
+        self.max_id = max_id or 0
+        # buffered messages never exceed read_ahead pages plus the page being consumed
+        self._queue = asyncio.Queue(max(1, int(read_ahead)))
+        self._task = None
+        self._page = []
+        self._pos = 0
+        self._done = False
+        self.pages = 0
+
+    async def _produce(self):
+        cursor = self.min_id
+        last_request = None
+        try:
+            while True:
+                if last_request is not None and self.wait_time:
+                    delay = self.wait_time - (time.monotonic() - last_request)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                last_request = time.monotonic()
+                page = await self.client.get_messages(self.src, limit=self.page_size, reverse=True, min_id=cursor, max_id=self.max_id)
+                page = [m for m in page if m is not None]
+                if not page:
+                    break
+                self.pages += 1
+                await self._queue.put(page)
+                cursor = page[-1].id
+            await self._queue.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._queue.put(e)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._produce())
+        while self._pos >= len(self._page):
+            if self._done:
+                raise StopAsyncIteration
+            page = await self._queue.get()
+            if page is None:
+                self._done = True
+                raise StopAsyncIteration
+            if isinstance(page, Exception):
+                self._done = True
+                raise page
+            self._page = page
+            self._pos = 0
+        msg = self._page[self._pos]
+        self._pos += 1
+        return msg
+
+    async def aclose(self):
+        self._done = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._page = []
+
+def parse_prefetch(cfg):
+    raw = cfg.get("history_prefetch", {})
+    if not isinstance(raw, dict):
+        raise ValueError("history_prefetch must be an object")
+    try:
+        opts = {
+            "page_size": int(raw.get("page_size", MAX_PAGE_SIZE)),
+            "read_ahead": int(raw.get("read_ahead", 2)),
+            "wait_time": float(raw.get("wait_time", 1.0)),
+        }
+    except (ValueError, TypeError):
+        raise ValueError("history_prefetch.page_size, read_ahead and wait_time must be numbers")
+    if not 1 <= opts["page_size"] <= MAX_PAGE_SIZE:
+        raise ValueError(f"history_prefetch.page_size must be between 1 and {MAX_PAGE_SIZE}")
+    if opts["read_ahead"] < 1:
+        raise ValueError("history_prefetch.read_ahead must be at least 1")
+    if opts["wait_time"] < 0:
+        raise ValueError("history_prefetch.wait_time must not be negative")
+    return opts
@@ -0,0 +1,183 @@
+import asyncio
+import time
+
+DEFAULT_ACCOUNT = "default"
+
+DEFAULT_RATE_LIMITS = {
+    "account_rate": 10.0,
+    "account_burst": 20,
+    "destination_rate": 2.0,
+    "destination_burst": 5,
+    "min_rate": 0.05,
+    "recover_after": 20,
+}
+
+class FloodWaitDeferred(Exception):
+    """Raised instead of sleeping when a destination is parked for longer than max_flood_wait."""
+
+    def __init__(self, dest, seconds):
+        super().__init__(f"destination {dest} is parked for {seconds:.0f}s by a flood wait (max_flood_wait exceeded)")
+        self.dest = dest
+        self.retry_after = seconds
+
+class TokenBucket:
+    def __init__(self, rate, burst, min_rate=0.05):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.successes = 0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self, now):
+        # reservations may drive tokens negative, which queues later callers behind earlier ones
+        self._refill(now)
+        self.tokens -= 1.0
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds, now):
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+        self.successes = 0
+
+    def slow_down(self, factor):
+        self.rate = max(self.min_rate, self.rate * factor)
+        self.successes = 0
+
+    def cap(self, rate, burst=None):
+        self.max_rate = max(self.min_rate, min(self.max_rate, rate))
+        self.rate = min(self.rate, self.max_rate)
+        if burst is not None:
+            self.burst = min(self.burst, float(burst))
+
+    def retune(self, rate, burst, min_rate):
+        # learned slow-downs and flood blocks carry over; an unthrottled bucket moves to the new rate
+        was_max = self.rate >= self.max_rate
+        self.max_rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate if was_max else max(self.min_rate, min(self.rate, self.max_rate))
+        self.burst = float(burst)
+        self.tokens = min(self.tokens, self.burst)
+
+    def record_success(self, recover_after):
+        if self.rate >= self.max_rate:
+            return
+        self.successes += 1
+        if self.successes >= recover_after:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+            self.successes = 0
+
+class RateLimiter:
+    def __init__(self, account_rate, account_burst, destination_rate, destination_burst, min_rate=0.05, recover_after=20):
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.destination_rate = destination_rate
+        self.destination_burst = destination_burst
+        self.min_rate = min_rate
+        self.recover_after = recover_after
+        self._accounts = {}
+        self._destinations = {}
+
+    def reconfigure(self, account_rate, account_burst, destination_rate, destination_burst, min_rate=0.05, recover_after=20):
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.destination_rate = destination_rate
+        self.destination_burst = destination_burst
+        self.min_rate = min_rate
+        self.recover_after = recover_after
+        for bucket in self._accounts.values():
+            bucket.retune(account_rate, account_burst, min_rate)
+        for bucket in self._destinations.values():
+            bucket.retune(destination_rate, destination_burst, min_rate)
+
+    def _account(self, account):
+        key = account or DEFAULT_ACCOUNT
+        bucket = self._accounts.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.account_rate, self.account_burst, self.min_rate)
+            self._accounts[key] = bucket
+        return bucket
+
+    def _destination(self, dest, account=None):
+        # flood and slow-mode limits are enforced per account, so each account gets its own
+        # bucket for a destination
+        key = (account or DEFAULT_ACCOUNT, dest)
+        bucket = self._destinations.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.destination_rate, self.destination_burst, self.min_rate)
+            self._destinations[key] = bucket
+        return bucket
+
+    async def acquire(self, dest, account=None):
+        now = time.monotonic()
+        wait = max(self._destination(dest, account).reserve(now), self._account(account).reserve(now))
+        if wait > 0:
+            await asyncio.sleep(wait)
+            return wait
+        return 0.0
+
+    def blocked_for(self, dest, account=None):
+        bucket = self._destinations.get((account or DEFAULT_ACCOUNT, dest))
+        if bucket is None:
+            return 0.0
+        return bucket.blocked_until - time.monotonic()
+
+    def record_success(self, dest, account=None):
+        self._destination(dest, account).record_success(self.recover_after)
+        self._account(account).record_success(self.recover_after)
+
+    def record_flood_wait(self, dest, seconds, account=None):
+        now = time.monotonic()
+        bucket = self._destination(dest, account)
+        bucket.block(seconds + 1, now)
+        bucket.slow_down(0.5)
+        self._account(account).slow_down(0.8)
+
+    def record_slow_mode(self, dest, seconds, account=None):
+        now = time.monotonic()
+        bucket = self._destination(dest, account)
+        bucket.block(seconds + 1, now)
+        if seconds > 0:
+            # slow mode is a fixed per-chat interval, so it becomes a hard ceiling for this destination
+            bucket.cap(1.0 / seconds, burst=1)
+
+def parse_rate_limits(cfg):
+    raw = cfg.get("rate_limits") or {}
+    if not isinstance(raw, dict):
+        raise ValueError("rate_limits must be an object")
+    limits = dict(DEFAULT_RATE_LIMITS)
+    legacy_interval = cfg.get("min_send_interval")
+    if legacy_interval:
+        try:
+            legacy_interval = float(legacy_interval)
+        except (ValueError, TypeError):
+            raise ValueError("min_send_interval must be a number")
+        if legacy_interval > 0:
+            limits["account_rate"] = 1.0 / legacy_interval
+            limits["account_burst"] = 1
+    for key, value in raw.items():
+        if key not in DEFAULT_RATE_LIMITS:
+            raise ValueError(f"Unknown rate_limits option: '{key}'")
+        try:
+            value = float(value)
+        except (ValueError, TypeError):
+            raise ValueError(f"rate_limits.{key} must be a number")
+        if value <= 0:
+            raise ValueError(f"rate_limits.{key} must be positive")
+        limits[key] = value
+    limits["account_burst"] = max(1.0, limits["account_burst"])
+    limits["destination_burst"] = max(1.0, limits["destination_burst"])
+    limits["recover_after"] = max(1, int(limits["recover_after"]))
+    return limits
+
+def build_rate_limiter(cfg):
+    return RateLimiter(**parse_rate_limits(cfg))
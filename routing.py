@@ -0,0 +1,131 @@
+from datetime import datetime
+from utils import KeywordMatcher, build_keyword_matcher, media_kind, MEDIA_KINDS
+
+class Route:
+    def __init__(self, name, sources, destinations, matcher, start_date=None, end_date=None, media=None):
+        self.name = name
+        self.sources = sources
+        self.destinations = destinations
+        self.matcher = matcher
+        self.start_date = start_date
+        self.end_date = end_date
+        self.media = media
+
+    def accepts(self, unit, text):
+        if self.start_date or self.end_date:
+            d = unit[0].date.date()
+            if self.start_date and d < self.start_date:
+                return False
+            if self.end_date and d > self.end_date:
+                return False
+        if self.media is not None:
+            if any(media_kind(m) not in self.media for m in unit):
+                return False
+            if not text and not (self.matcher.keywords or self.matcher.regex):
+                # a pure media route also takes uncaptioned files, which keyword matching never does
+                return True
+        return self.matcher.matches(text)
+
+class RoutingTable:
+    """Routes compiled into a per-source index, so a message is only checked against its own source's rules."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self._by_source = {}
+        destinations = []
+        for route in routes:
+            for src in route.sources:
+                self._by_source.setdefault(src, []).append(route)
+            for d in route.destinations:
+                if d not in destinations:
+                    destinations.append(d)
+        self.sources = list(self._by_source)
+        self.destinations = destinations
+
+    def routes_for(self, src):
+        return self._by_source.get(src, ())
+
+    def source_destinations(self, src):
+        # every destination any of the source's routes sends to, regardless of filters
+        dests = []
+        for route in self._by_source.get(src, ()):
+            dests.extend(d for d in route.destinations if d not in dests)
+        return dests
+
+    def destinations_for(self, src, unit):
+        routes = self._by_source.get(src)
+        if not routes:
+            return ()
+        text = (unit[0].text or "") if len(unit) == 1 else "\n".join(m.text for m in unit if m.text)
+        if len(routes) == 1:
+            route = routes[0]
+            return route.destinations if route.accepts(unit, text) else ()
+        dests = []
+        for route in routes:
+            if route.accepts(unit, text):
+                dests.extend(d for d in route.destinations if d not in dests)
+        return tuple(dests)
+
+    def highlight_matcher(self):
+        # a copy-mode payload is shared by every destination, so highlighting covers all routes' keywords
+        if len(self.routes) == 1:
+            return self.routes[0].matcher
+        keywords, regex = [], []
+        for route in self.routes:
+            keywords.extend(k for k in route.matcher.keywords if k not in keywords)
+            regex.extend(r for r in route.matcher.regex if r not in regex)
+        return KeywordMatcher(keywords, regex=regex, whole_word=self.routes[0].matcher.whole_word)
+
+def _ids(raw, what):
+    if not isinstance(raw, list) or not raw:
+        raise ValueError(f"{what} must be a non-empty list")
+    try:
+        return [int(x) for x in raw]
+    except (ValueError, TypeError):
+        raise ValueError(f"{what} must contain numeric channel IDs")
+
+def _date(raw, what):
+    if not raw:
+        return None
+    try:
+        return datetime.strptime(raw, "%Y-%m-%d").date()
+    except (ValueError, TypeError):
+        raise ValueError(f"{what} must be a date in YYYY-MM-DD format")
+
+def routed_sources(cfg):
+    sources = [int(s) for s in cfg.get("sources", [])]
+    for route in cfg.get("routes") or []:
+        for s in route.get("sources", []):
+            if int(s) not in sources:
+                sources.append(int(s))
+    return sources
+
+def build_routing_table(cfg, sources, destinations, matcher):
+    routes = []
+    if sources and destinations:
+        # the top-level sources, destinations and keywords form the default route
+        routes.append(Route("default", sources, destinations, matcher))
+    raw = cfg.get("routes", [])
+    if not isinstance(raw, list):
+        raise ValueError("routes must be a list")
+    for i, entry in enumerate(raw):
+        if not isinstance(entry, dict):
+            raise ValueError(f"routes[{i}] must be an object")
+        name = str(entry.get("name", f"route {i + 1}"))
+        media = entry.get("media")
+        if media is not None:
+            if not isinstance(media, list) or not media or any(m not in MEDIA_KINDS for m in media):
+                raise ValueError(f"routes[{i}].media must be a non-empty list of: {', '.join(MEDIA_KINDS)}")
+            media = frozenset(media)
+        # whole_word_keywords is inherited unless the route sets it
+        route_matcher = build_keyword_matcher(dict({"whole_word_keywords": cfg.get("whole_word_keywords", False)}, **entry))
+        routes.append(Route(
+            name,
+            _ids(entry.get("sources"), f"routes[{i}].sources"),
+            _ids(entry.get("destinations"), f"routes[{i}].destinations"),
+            route_matcher,
+            _date(entry.get("start_date"), f"routes[{i}].start_date"),
+            _date(entry.get("end_date"), f"routes[{i}].end_date"),
+            media,
+        ))
+    return RoutingTable(routes)
@@ -0,0 +1,71 @@
+MAX_ALBUM_SIZE = 10
+
+def search_terms(matchers, max_terms=20):
+    # server-side search only understands plain words, so regex rules or an empty keyword list
+    # (forward everything) cannot be pushed down; several matchers (routes) search for their union.
+    # telegram finds words and word prefixes, which covers every whole-word match but misses a keyword
+    # inside a longer word, so substring matching needs the full scan
+    if not matchers or any(m.regex or not m.keywords or not m.whole_word for m in matchers):
+        return None
+    terms = []
+    seen = set()
+    for k in (k for m in matchers for k in m.keywords):
+        term = k.strip().casefold()
+        if term and term not in seen:
+            seen.add(term)
+            terms.append(term)
+    if not terms or len(terms) > max_terms:
+        return None
+    return terms
+
+async def _next(stream):
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def merge_ascending(streams):
+    # k-way merge of ascending per-keyword results; a message matching several keywords is yielded once
+    heads = []
+    for stream in streams:
+        msg = await _next(stream)
+        if msg is not None:
+            heads.append([msg, stream])
+    last_id = None
+    while heads:
+        head = min(heads, key=lambda h: h[0].id)
+        msg = head[0]
+        if msg.id != last_id:
+            last_id = msg.id
+            yield msg
+        nxt = await _next(head[1])
+        if nxt is None:
+            heads.remove(head)
+        else:
+            head[0] = nxt
+
+async def _album_around(client, src, msg, min_id, max_id):
+    # search returns only the album item carrying the keyword; the other items sit at adjacent ids
+    ids = list(range(max(1, msg.id - MAX_ALBUM_SIZE + 1), msg.id + MAX_ALBUM_SIZE))
+    parts = await client.get_messages(src, ids=ids)
+    unit = [
+        m for m in parts
+        if m is not None and m.grouped_id == msg.grouped_id and m.id > min_id and (not max_id or m.id < max_id)
+    ]
+    return sorted(unit, key=lambda m: m.id) or [msg]
+
+async def search_history(client, src, terms, min_id=0, max_id=0):
+    streams = [
+        client.iter_messages(src, search=term, reverse=True, min_id=min_id, max_id=max_id)
+        for term in terms
+    ]
+    last_album = None
+    async for msg in merge_ascending(streams):
+        gid = getattr(msg, "grouped_id", None)
+        if gid is None:
+            yield [msg]
+            continue
+        if gid == last_album:
+            continue
+        last_album = gid
+        yield await _album_around(client, src, msg, min_id, max_id)
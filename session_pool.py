@@ -0,0 +1,133 @@
+import bisect
+import hashlib
+import os
+from collections import OrderedDict
+from colorama import Fore
+
+SELECTION_POLICIES = ("hash", "least_loaded")
+
+def resolve_session_path(name):
+    if not os.path.isabs(name) and not os.path.dirname(name):
+        name = os.path.join("data", name)
+    dirn = os.path.dirname(name)
+    if dirn:
+        os.makedirs(dirn, exist_ok=True)
+    return name
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(str(value).encode("utf-8")).digest()[:8], "big")
+
+class SenderSession:
+    def __init__(self, name, client, is_reader=False, phone=None, bot_token=None):
+        self.name = name
+        self.client = client
+        self.is_reader = is_reader
+        self.phone = phone
+        self.bot_token = bot_token
+        self.load = 0
+        self._messages = OrderedDict()
+
+    async def own_message(self, msg):
+        # media references (access_hash/file_reference) are bound to the account that fetched
+        # them, so other accounts re-read the message through their own session first
+        if self.is_reader:
+            return msg
+        key = (msg.chat_id, msg.id)
+        own = self._messages.get(key)
+        if own is None:
+            own = await self.client.get_messages(msg.chat_id, ids=msg.id)
+            if own is None:
+                raise RuntimeError(f"Sender {self.name} cannot access message {msg.id} in {msg.chat_id}")
+            self._messages[key] = own
+            if len(self._messages) > 512:
+                self._messages.popitem(last=False)
+        return own
+
+    async def refresh(self, msg):
+        own = await self.client.get_messages(msg.chat_id, ids=msg.id)
+        if own is None:
+            raise RuntimeError(f"Message {msg.id} in {msg.chat_id} is no longer available")
+        if not self.is_reader:
+            self._messages[(msg.chat_id, msg.id)] = own
+        return own
+
+class SessionPool:
+    def __init__(self, sessions, rate_limiter, selection="hash", vnodes=64):
+        self.sessions = sessions
+        self.rate_limiter = rate_limiter
+        self.selection = selection
+        self._ring = sorted((_hash(f"{s.name}#{i}"), s) for s in sessions for i in range(vnodes))
+        self._ring_keys = [k for k, _ in self._ring]
+
+    def _candidates(self, dest):
+        if self.selection == "least_loaded":
+            return sorted(self.sessions, key=lambda s: (s.load, s.name))
+        start = bisect.bisect(self._ring_keys, _hash(dest)) % len(self._ring)
+        seen = []
+        for i in range(len(self._ring)):
+            s = self._ring[(start + i) % len(self._ring)][1]
+            if s not in seen:
+                seen.append(s)
+                if len(seen) == len(self.sessions):
+                    break
+        return seen
+
+    def pick(self, dest):
+        candidates = self._candidates(dest)
+        if len(candidates) == 1:
+            return candidates[0]
+        # fail over past sessions that are parked by a FloodWait for this destination
+        best = None
+        best_wait = None
+        for s in candidates:
+            wait = self.rate_limiter.blocked_for(dest, s.name)
+            if wait <= 0:
+                return s
+            if best_wait is None or wait < best_wait:
+                best, best_wait = s, wait
+        return best
+
+    async def start(self):
+        for s in self.sessions:
+            if s.is_reader:
+                continue
+            if s.bot_token:
+                await s.client.start(bot_token=s.bot_token)
+            else:
+                await s.client.start(s.phone)
+            # fill the entity cache so numeric channel ids resolve for this account
+            await s.client.get_dialogs()
+            print(Fore.GREEN + f"Sender session '{s.name}' ready.")
+
+    async def disconnect(self):
+        for s in self.sessions:
+            if not s.is_reader:
+                await s.client.disconnect()
+
+def build_session_pool(cfg, reader, rate_limiter, client_factory):
+    raw = cfg.get("sender_sessions", [])
+    if not isinstance(raw, list):
+        raise ValueError("sender_sessions must be a list")
+    selection = cfg.get("sender_selection", "hash")
+    if selection not in SELECTION_POLICIES:
+        raise ValueError(f"sender_selection must be one of {', '.join(SELECTION_POLICIES)}")
+    if not raw:
+        return SessionPool([SenderSession(cfg["session_name"], reader, is_reader=True)], rate_limiter, selection)
+    sessions = []
+    for i, entry in enumerate(raw):
+        if not isinstance(entry, dict):
+            raise ValueError(f"sender_sessions[{i}] must be an object")
+        name = entry.get("session_name")
+        if not isinstance(name, str) or not name:
+            raise ValueError(f"sender_sessions[{i}].session_name must be a non-empty string")
+        if not entry.get("phone") and not entry.get("bot_token"):
+            raise ValueError(f"sender_sessions[{i}] needs a phone or a bot_token")
+        api_id = entry.get("api_id", cfg["api_id"])
+        if not isinstance(api_id, int):
+            raise ValueError(f"sender_sessions[{i}].api_id must be an integer")
+        client = client_factory(resolve_session_path(name), api_id, entry.get("api_hash", cfg["api_hash"]))
+        client.parse_mode = 'html'
+        sessions.append(SenderSession(name, client, phone=entry.get("phone"), bot_token=entry.get("bot_token")))
+    if cfg.get("reader_sends", False):
+        sessions.append(SenderSession(cfg["session_name"], reader, is_reader=True))
+    return SessionPool(sessions, rate_limiter, selection)
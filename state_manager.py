@@ -1,18 +1,28 @@
+import asyncio
+import atexit
+from abc import ABC, abstractmethod
 import json
 import os
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
 
 DATA_DIR = "data"
 STATE_FILE = os.path.join(DATA_DIR, "forwarder_state.json")
+STATE_DB = os.path.join(DATA_DIR, "forwarder_state.db")
 
-def load_state():
-    if os.path.exists(STATE_FILE):
+def load_state(path=STATE_FILE):
+    if os.path.exists(path):
         try:
-            with open(STATE_FILE, "r", encoding="utf-8") as f:
+            with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
         except Exception as e:
             print(f"Error loading state file: {e}")
             return {}
-    if os.path.exists("forwarder_state.json"):
+    if path == STATE_FILE and os.path.exists("forwarder_state.json"):
+        # pre-data/ location; only the default state file migrates from there
         try:
             with open("forwarder_state.json", "r", encoding="utf-8") as f:
                 return json.load(f)
@@ -21,21 +31,282 @@ def load_state():
             return {}
     return {}
 
-def save_state(state):
+def save_state(state, path=STATE_FILE, indent=4):
     try:
-        os.makedirs(DATA_DIR, exist_ok=True)
-        with open(STATE_FILE, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=4)
+        dirn = os.path.dirname(path) or "."
+        os.makedirs(dirn, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".state-", suffix=".tmp", dir=dirn)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f, indent=indent)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
     except Exception as e:
         print(f"Error saving state file: {e}")
-        
-def get_last_read_message_id(source_id):
-    state = load_state()
-    return state.get(str(source_id), 0)
-
-def update_last_read_message_id(source_id, message_id):
-    state = load_state()
-    current_id = state.get(str(source_id), 0)
-    if message_id > current_id:
-        state[str(source_id)] = message_id
-        save_state(state)
+
+class StateBackend(ABC):
+    supports_ledger = False
+
+    def __init__(self, flush_interval=5.0, flush_every=500):
+        self.flush_interval = float(flush_interval)
+        self.flush_every = max(1, int(flush_every))
+        self._dirty = 0
+        self._seq = 0
+        self._written_seq = 0
+        self._write_lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+        self._holds = {}
+
+    @abstractmethod
+    def get(self, source_id):
+        pass
+
+    @abstractmethod
+    def update(self, source_id, message_id):
+        pass
+
+    def hold(self, source_id, message_id):
+        # what gets written stays at or below message_id until release(), while older ids are still
+        # being backfilled; the in-memory checkpoint keeps moving
+        key = str(source_id)
+        self._holds[key] = min(self._holds.get(key, message_id), message_id)
+
+    def release(self, source_id):
+        if self._holds.pop(str(source_id), None) is not None:
+            self._mark_dirty()
+
+    def _held(self, offsets):
+        if not self._holds:
+            return dict(offsets)
+        return {k: min(v, self._holds[k]) if k in self._holds else v for k, v in offsets.items()}
+
+    def record_delivery(self, source_id, message_id, dest):
+        pass
+
+    def delivered(self, source_id, message_id):
+        return set()
+
+    def _mark_dirty(self):
+        self._dirty += 1
+        if self._dirty >= self.flush_every and self._wakeup is not None:
+            self._wakeup.set()
+
+    @abstractmethod
+    def _take_snapshot(self):
+        pass
+
+    @abstractmethod
+    def _persist(self, snapshot):
+        pass
+
+    def _snapshot(self):
+        self._seq += 1
+        self._dirty = 0
+        return self._seq, self._take_snapshot()
+
+    def _write(self, seq, snapshot):
+        with self._write_lock:
+            # a newer snapshot may already be on disk if a sync flush raced the executor
+            if seq <= self._written_seq:
+                return
+            self._persist(snapshot)
+            self._written_seq = seq
+
+    def flush(self):
+        if not self._dirty:
+            return
+        self._write(*self._snapshot())
+
+    async def _flush_async(self):
+        if not self._dirty:
+            return
+        seq, snapshot = self._snapshot()
+        await asyncio.get_running_loop().run_in_executor(None, self._write, seq, snapshot)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush_async()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            atexit.register(self.flush)
+            install_signal_flush(self)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        self.flush()
+
+class CheckpointStore(StateBackend):
+    def __init__(self, flush_interval=5.0, flush_every=500, path=STATE_FILE):
+        super().__init__(flush_interval, flush_every)
+        self.path = path
+        self._state = load_state(path)
+
+    def get(self, source_id):
+        return self._state.get(str(source_id), 0)
+
+    def update(self, source_id, message_id):
+        key = str(source_id)
+        if message_id > self._state.get(key, 0):
+            self._state[key] = message_id
+            self._mark_dirty()
+
+    def _take_snapshot(self):
+        return self._held(self._state)
+
+    def _persist(self, snapshot):
+        save_state(snapshot, self.path)
+
+class SqliteStateBackend(StateBackend):
+    supports_ledger = True
+
+    def __init__(self, flush_interval=5.0, flush_every=500, path=STATE_DB, ledger_retention_days=7, legacy_path=STATE_FILE):
+        super().__init__(flush_interval, flush_every)
+        self.path = path
+        self.ledger_retention = float(ledger_retention_days) * 86400
+        dirn = os.path.dirname(path)
+        if dirn:
+            os.makedirs(dirn, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS offsets ("
+            "source_id TEXT PRIMARY KEY, message_id INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            "source_id TEXT NOT NULL, message_id INTEGER NOT NULL, destination TEXT NOT NULL, "
+            "delivered_at REAL NOT NULL, PRIMARY KEY (source_id, message_id, destination))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS deliveries_age ON deliveries (delivered_at)")
+        # reads happen on the event loop while flushes commit from an executor thread;
+        # WAL lets a second connection read without waiting on the writer
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._offsets = dict(self._conn.execute("SELECT source_id, message_id FROM offsets"))
+        self._dirty_offsets = {}
+        self._pending = []
+        self._pending_index = {}
+        self._last_prune = 0.0
+        if not self._offsets:
+            legacy = load_state(legacy_path)
+            if legacy:
+                self._offsets = {str(k): int(v) for k, v in legacy.items()}
+                self._dirty_offsets = dict(self._offsets)
+                self._dirty = 1
+
+    def get(self, source_id):
+        return self._offsets.get(str(source_id), 0)
+
+    def update(self, source_id, message_id):
+        key = str(source_id)
+        if message_id > self._offsets.get(key, 0):
+            self._offsets[key] = message_id
+            self._dirty_offsets[key] = message_id
+            self._mark_dirty()
+
+    def release(self, source_id):
+        key = str(source_id)
+        if key in self._holds and key in self._offsets:
+            self._dirty_offsets[key] = self._offsets[key]
+        super().release(source_id)
+
+    def record_delivery(self, source_id, message_id, dest):
+        key = (str(source_id), message_id)
+        self._pending.append((key[0], message_id, str(dest), time.time()))
+        self._pending_index.setdefault(key, set()).add(str(dest))
+        self._mark_dirty()
+
+    def delivered(self, source_id, message_id):
+        key = (str(source_id), message_id)
+        rows = self._reader.execute(
+            "SELECT destination FROM deliveries WHERE source_id = ? AND message_id = ?", key
+        ).fetchall()
+        found = {r[0] for r in rows}
+        found.update(self._pending_index.get(key, ()))
+        return {int(d) for d in found}
+
+    def _take_snapshot(self):
+        offsets, self._dirty_offsets = self._held(self._dirty_offsets), {}
+        pending, self._pending = self._pending, []
+        self._pending_index = {}
+        return offsets, pending
+
+    def _persist(self, snapshot):
+        offsets, pending = snapshot
+        conn = self._conn
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO offsets (source_id, message_id) VALUES (?, ?) "
+                "ON CONFLICT(source_id) DO UPDATE SET message_id = MAX(message_id, excluded.message_id)",
+                list(offsets.items()),
+            )
+            conn.executemany("INSERT OR IGNORE INTO deliveries VALUES (?, ?, ?, ?)", pending)
+            now = time.time()
+            if now - self._last_prune > 3600:
+                conn.execute("DELETE FROM deliveries WHERE delivered_at < ?", (now - self.ledger_retention,))
+                self._last_prune = now
+            conn.execute("COMMIT")
+        except Exception as e:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            print(f"Error saving state database: {e}")
+
+    async def close(self):
+        await super().close()
+        with self._write_lock:
+            self._conn.close()
+        self._reader.close()
+
+def install_signal_flush(store):
+    if threading.current_thread() is not threading.main_thread():
+        return
+    def handler(signum, frame):
+        store.flush()
+        raise SystemExit(128 + signum)
+    try:
+        signal.signal(signal.SIGTERM, handler)
+    except (ValueError, OSError, AttributeError):
+        pass
+
+def open_state_backend(cfg):
+    backend = cfg.get("state_backend", "json")
+    kwargs = {
+        "flush_interval": cfg.get("state_flush_interval", 5.0),
+        "flush_every": cfg.get("state_flush_every", 500),
+    }
+    if backend == "json":
+        return CheckpointStore(path=cfg.get("state_file", STATE_FILE), **kwargs)
+    if backend == "sqlite":
+        return SqliteStateBackend(
+            path=cfg.get("state_db", STATE_DB),
+            ledger_retention_days=cfg.get("ledger_retention_days", 7),
+            legacy_path=cfg.get("state_file", STATE_FILE),
+            **kwargs,
+        )
+    raise ValueError(f"Unknown state_backend '{backend}'. Use 'json' or 'sqlite'.")
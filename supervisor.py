@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import zlib
+from colorama import Fore, init
+from config_manager import load_config
+from routing import routed_sources
+from rate_limiter import parse_rate_limits
+from state_manager import DATA_DIR
+
+CONFIG_ERROR_EXIT = 78
+
+def shard_for(source_id, shards):
+    # crc32 is stable across processes and runs, unlike hash() on str
+    return zlib.crc32(str(int(source_id)).encode("utf-8")) % shards
+
+def partition_sources(sources, shards):
+    parts = [[] for _ in range(shards)]
+    for src in sources:
+        parts[shard_for(src, shards)].append(src)
+    return parts
+
+def shard_session_name(cfg, index):
+    names = cfg.get("shard_sessions") or []
+    if index < len(names):
+        return names[index]
+    return f"{cfg['session_name']}_shard{index}"
+
+def shard_rate_limits(cfg, shards):
+    # every shard logs in with the same phone and sender accounts and may send to the same
+    # destinations, so the per-account and per-destination budgets are split between the workers
+    limits = parse_rate_limits(cfg)
+    for kind in ("account", "destination"):
+        limits[f"{kind}_rate"] = limits[f"{kind}_rate"] / shards
+        limits[f"{kind}_burst"] = max(1.0, limits[f"{kind}_burst"] / shards)
+    return limits
+
+def shard_config(cfg, index, sources, shards=1):
+    shard = dict(cfg)
+    owned = set(sources)
+    shard["sources"] = [s for s in cfg.get("sources", []) if int(s) in owned]
+    if cfg.get("routes"):
+        # each worker only keeps the part of every route that reads its own sources
+        routes = []
+        for route in cfg["routes"]:
+            route_sources = [s for s in route.get("sources", []) if int(s) in owned]
+            if route_sources:
+                routes.append(dict(route, sources=route_sources))
+        shard["routes"] = routes
+    shard["session_name"] = shard_session_name(cfg, index)
+    shard.pop("min_send_interval", None)
+    shard["rate_limits"] = shard_rate_limits(cfg, shards)
+    shard["state_file"] = os.path.join(DATA_DIR, f"forwarder_state.shard{index}.json")
+    shard["state_db"] = os.path.join(DATA_DIR, f"forwarder_state.shard{index}.db")
+    shard["date_index_file"] = os.path.join(DATA_DIR, f"date_index.shard{index}.json")
+    dedup = cfg.get("dedup", {})
+    if isinstance(dedup, dict):
+        dedup = dict(dedup)
+        dedup["path"] = os.path.join(DATA_DIR, f"dedup_index.shard{index}.json")
+        shard["dedup"] = dedup
+    senders = cfg.get("sender_sessions") or []
+    if senders:
+        # telethon session files cannot be shared between processes
+        shard["sender_sessions"] = [dict(e, session_name=f"{e['session_name']}_shard{index}") for e in senders]
+    outbox = cfg.get("outbox", {})
+    if isinstance(outbox, dict):
+        outbox = dict(outbox)
+        outbox["path"] = os.path.join(DATA_DIR, f"outbox.shard{index}.db")
+        shard["outbox"] = outbox
+    metrics = cfg.get("metrics", {})
+    if isinstance(metrics, dict) and metrics.get("port"):
+        # workers cannot listen on the same port, so shard N serves its metrics on the configured port + N
+        try:
+            port = int(metrics["port"])
+        except (ValueError, TypeError):
+            raise ValueError("metrics.port must be a number")
+        shard["metrics"] = dict(metrics, port=port + index)
+    # a reload would read the full config and undo the per-shard overrides above
+    shard["config_reload"] = False
+    live_queue = dict(cfg.get("live_queue", {}))
+    live_queue["spill_file"] = os.path.join(DATA_DIR, f"live_spill.shard{index}.jsonl")
+    shard["live_queue"] = live_queue
+    return shard
+
+async def _login(cfg):
+    from telethon import TelegramClient
+    from session_pool import resolve_session_path
+    entries = [cfg] + list(cfg.get("sender_sessions") or [])
+    for entry in entries:
+        client = TelegramClient(
+            resolve_session_path(entry["session_name"]),
+            entry.get("api_id", cfg["api_id"]),
+            entry.get("api_hash", cfg["api_hash"]),
+        )
+        if entry.get("bot_token"):
+            await client.start(bot_token=entry["bot_token"])
+        else:
+            await client.start(entry["phone"])
+        await client.disconnect()
+
+async def _report_stats(fwd, index, stats_queue, interval):
+    while True:
+        await asyncio.sleep(interval)
+        stats_queue.put((index, fwd.stats()))
+
+async def _run_worker(cfg, index, stats_queue, interval):
+    from core import Forwarder
+    fwd = Forwarder(cfg)
+    await fwd.start()
+    reporter = asyncio.get_running_loop().create_task(_report_stats(fwd, index, stats_queue, interval))
+    try:
+        await fwd.run()
+    finally:
+        reporter.cancel()
+        stats_queue.put((index, fwd.stats()))
+
+def _worker_main(cfg, index, stats_queue, interval):
+    init(autoreset=True)
+    # the supervisor handles Ctrl+C and stops workers with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    print(Fore.CYAN + f"[shard {index}] starting with {len(routed_sources(cfg))} source(s)")
+    try:
+        asyncio.run(_run_worker(cfg, index, stats_queue, interval))
+    except ValueError as e:
+        print(Fore.RED + f"[shard {index}] configuration error: {e}")
+        raise SystemExit(CONFIG_ERROR_EXIT)
+
+class Supervisor:
+    def __init__(self, cfg, shards, stats_interval=30.0, max_restart_delay=60.0):
+        self.cfg = cfg
+        self.shards = shards
+        self.stats_interval = stats_interval
+        self.max_restart_delay = max_restart_delay
+        self.configs = {}
+        parts = partition_sources(routed_sources(cfg), shards)
+        active = sum(1 for sources in parts if sources)
+        for i, sources in enumerate(parts):
+            if sources:
+                self.configs[i] = shard_config(cfg, i, sources, active)
+        self.stats_queue = multiprocessing.Queue()
+        self.processes = {}
+        self.restarts = {i: 0 for i in self.configs}
+        self.next_start = {i: 0.0 for i in self.configs}
+        self.stats = {}
+        self.finished = set()
+        self._stopping = False
+
+    def prepare_sessions(self):
+        # workers have no terminal, so any first-time logins happen here, one shard at a time
+        for i, shard in self.configs.items():
+            print(Fore.CYAN + f"Checking session for shard {i} ({shard['session_name']})...")
+            asyncio.run(_login(shard))
+
+    def _spawn(self, i):
+        p = multiprocessing.Process(
+            target=_worker_main,
+            args=(self.configs[i], i, self.stats_queue, self.stats_interval),
+            name=f"forwarder-shard-{i}",
+        )
+        p.start()
+        self.processes[i] = p
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for i in self.configs:
+            if i in self.finished:
+                continue
+            p = self.processes.get(i)
+            if p is not None and p.is_alive():
+                continue
+            if p is not None:
+                p.join()
+                self.processes.pop(i)
+                if p.exitcode == 0 and self.configs[i].get("mode", "both") in ("past", "id_range"):
+                    # a listening worker never finishes on its own; exiting cleanly means its client dropped
+                    print(Fore.CYAN + f"[shard {i}] finished.")
+                    self.finished.add(i)
+                    continue
+                if p.exitcode == CONFIG_ERROR_EXIT:
+                    print(Fore.RED + f"[shard {i}] stopped because of a configuration error; not restarting.")
+                    self.finished.add(i)
+                    continue
+                self.restarts[i] += 1
+                delay = min(self.max_restart_delay, 2 ** min(self.restarts[i], 6))
+                self.next_start[i] = now + delay
+                print(Fore.RED + f"[shard {i}] exited with code {p.exitcode}. Restarting in {delay}s.")
+                continue
+            if now >= self.next_start[i]:
+                self._spawn(i)
+
+    def _drain_stats(self):
+        while True:
+            try:
+                index, stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.stats[index] = stats
+
+    def _print_summary(self):
+        forwarded = sum(s.get("forwarded", 0) for s in self.stats.values())
+        depth = sum(s.get("queue_depth", 0) for s in self.stats.values())
+        alive = sum(1 for p in self.processes.values() if p.is_alive())
+        restarts = sum(self.restarts.values())
+        print(Fore.CYAN + f"[supervisor] workers={alive}/{len(self.configs)} forwarded={forwarded} queue_depth={depth} restarts={restarts}")
+
+    def stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        if not self.configs:
+            print(Fore.YELLOW + "No sources to shard. Exiting.")
+            return
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        last_summary = time.monotonic()
+        while not self._stopping and len(self.finished) < len(self.configs):
+            self._check_workers()
+            self._drain_stats()
+            if time.monotonic() - last_summary >= self.stats_interval:
+                self._print_summary()
+                last_summary = time.monotonic()
+            time.sleep(0.5)
+        for p in self.processes.values():
+            if p.is_alive():
+                p.terminate()
+        for p in self.processes.values():
+            p.join(timeout=30)
+        self._drain_stats()
+        self._print_summary()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the forwarder as several worker processes, each owning a shard of the sources.")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 2, help="number of worker processes")
+    parser.add_argument("--stats-interval", type=float, default=30.0, help="seconds between aggregated stats lines")
+    args = parser.parse_args(argv)
+    init(autoreset=True)
+    cfg = load_config()
+    if cfg is None:
+        print(Fore.RED + "No configuration found. Run 'python main.py' once to create it.")
+        return
+    if args.shards < 1:
+        print(Fore.RED + "--shards must be at least 1.")
+        return
+    try:
+        sup = Supervisor(cfg, args.shards, stats_interval=args.stats_interval)
+    except ValueError as e:
+        print(Fore.RED + f"Configuration error: {e}")
+        return
+    sup.prepare_sessions()
+    sup.run()
+
+if __name__ == "__main__":
+    main()
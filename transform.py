@@ -0,0 +1,113 @@
+import time
+from datetime import timezone
+from functools import partial
+from telethon.tl.types import MessageMediaWebPage
+from utils import strip_signature, escape_html
+
+# telegram rejects media captions longer than this
+CAPTION_LIMIT = 1024
+
+class Payload:
+    """A unit rendered once for copy mode; every destination sends the same payload."""
+
+    __slots__ = ("kind", "text", "captions")
+
+    def __init__(self, kind, text=None, captions=None):
+        # kind is "media" (captions go with the files), "media_then_text" (files, then text as
+        # a separate message), "text" or "forward" (nothing to copy, forward the original)
+        self.kind = kind
+        self.text = text
+        self.captions = captions
+
+class StageProfile:
+    """Accumulates time spent in each pipeline stage."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+
+    def __call__(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def report(self):
+        lines = []
+        for stage, total in sorted(self.seconds.items(), key=lambda kv: -kv[1]):
+            calls = self.calls[stage]
+            lines.append(f"{stage}: {total * 1000:.1f}ms total, {total / calls * 1e6:.1f}us x {calls}")
+        return lines
+
+def _footer(msg):
+    orig = getattr(getattr(msg, "fwd_from", None), "date", None) or msg.date
+    if getattr(orig, "tzinfo", None) is None:
+        orig = orig.replace(tzinfo=timezone.utc)
+    return "\n\n" + orig.astimezone().strftime("%Y-%m-%d %H:%M")
+
+class TransformPipeline:
+    def __init__(self, text_stages, footer=None, caption_limit=CAPTION_LIMIT, hook=None):
+        self.text_stages = list(text_stages)
+        self.footer = footer
+        self.caption_limit = caption_limit
+        self.hook = hook
+
+    def _run(self, stage, fn, value):
+        if self.hook is None:
+            return fn(value)
+        started = time.perf_counter()
+        out = fn(value)
+        self.hook(stage, time.perf_counter() - started)
+        return out
+
+    def text(self, msg):
+        text = msg.text or ""
+        for name, fn in self.text_stages:
+            if not text:
+                break
+            text = self._run(name, fn, text)
+        return text
+
+    def footer_for(self, msg):
+        if self.footer is None:
+            return ""
+        return self._run("footer", self.footer, msg)
+
+    def render(self, unit):
+        captions = [self.text(m) for m in unit]
+        footer = self.footer_for(unit[0])
+        return self._run("layout", partial(self._layout, captions, footer), unit)
+
+    def _layout(self, captions, footer, unit):
+        if len(unit) > 1:
+            if footer:
+                # telegram shows an album caption under the item that carries it
+                idx = max((i for i, c in enumerate(captions) if c), default=0)
+                captions[idx] = captions[idx] + footer
+            if any(len(c) > self.caption_limit for c in captions):
+                return Payload("media_then_text", text="\n\n".join(c for c in captions if c))
+            return Payload("media", captions=captions)
+        msg = unit[0]
+        text = captions[0]
+        if bool(msg.media) and not isinstance(msg.media, MessageMediaWebPage):
+            cap = (text + footer) if footer else (text if text else None)
+            if cap and len(cap) > self.caption_limit:
+                return Payload("media_then_text", text=cap)
+            return Payload("media", captions=[cap])
+        if not text:
+            return Payload("forward")
+        wp = getattr(msg.media, "webpage", None)
+        url = getattr(wp, "url", None) if wp else None
+        if url and url not in text:
+            text = f"{text}\n{url}"
+        return Payload("text", text=text + footer)
+
+def build_transform_pipeline(cfg, matcher, hook=None):
+    stages = []
+    if cfg.get("remove_signature", False):
+        stages.append(("strip_signature", partial(strip_signature, delimiters=cfg.get("signature_delimiters", []))))
+    # highlighting escapes the text around each keyword itself
+    if cfg.get("highlight_keywords", cfg.get("bold_keywords", False)):
+        stages.append(("highlight", matcher.highlight))
+    else:
+        stages.append(("escape", escape_html))
+    footer = _footer if cfg.get("append_timestamp_footer", False) else None
+    return TransformPipeline(stages, footer, hook=hook)
@@ -1,31 +1,157 @@
 import re
 import html
 
-def match_keywords(text, keywords):
-    if not text:
-        return False
-    if not keywords:
-        return True
-    
-    text_lower = text.lower()
-    return any(k.lower() in text_lower for k in keywords)
+HIGHLIGHT_TEMPLATE = "<u><b><i>{}</i></b></u>"
+
+def _trie_pattern(words):
+    # a prefix-factored alternation lets the regex engine walk keywords like a trie
+    # instead of retrying every keyword at every position
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = None
+
+    def build(node):
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+# global inline flags such as (?i) are only valid at the very start of a pattern
+_GLOBAL_FLAGS = re.compile(r"^(?:\(\?[aiLmsux]+\))+")
+
+class KeywordMatcher:
+    def __init__(self, keywords=None, exclude=None, regex=None, whole_word=False):
+        self.keywords = [k for k in (keywords or []) if k]
+        self.exclude = [k for k in (exclude or []) if k]
+        self.regex = [r for r in (regex or []) if r]
+        self.whole_word = bool(whole_word)
+        # each regex rule is its own pattern: joined into one, group names and backreferences would clash
+        regex_patterns = []
+        for r in self.regex:
+            try:
+                regex_patterns.append(self._pattern(r))
+            except re.error as e:
+                raise ValueError(f"Invalid regex keyword '{r}': {e}")
+        self._include = self._keyword_patterns(self.keywords) + regex_patterns
+        self._exclude = self._keyword_patterns(self.exclude)
+
+    def _pattern(self, body):
+        flags = _GLOBAL_FLAGS.match(body)
+        flags, body = (flags.group(0), body[flags.end():]) if flags else ("", body)
+        if self.whole_word:
+            # a verbose-mode comment would swallow the closing part without a line break
+            end = "\n" if "x" in flags else ""
+            body = rf"(?<!\w)(?:{body}{end})(?!\w)"
+        return re.compile(flags + body, re.IGNORECASE)
+
+    def _keyword_patterns(self, words):
+        folded = sorted({w.casefold() for w in words})
+        return [self._pattern(_trie_pattern(folded))] if folded else []
+
+    def _fold(self, text):
+        # casefold() can change the length of a few characters (e.g. "ß", "İ"), so when it does,
+        # positions[i] is the index in text of the character that folded into position i
+        folded = text.casefold()
+        if len(folded) == len(text):
+            return folded, None
+        positions = []
+        for i, ch in enumerate(text):
+            positions.extend([i] * len(ch.casefold()))
+        return folded, positions
+
+    def spans(self, text):
+        if not text or not self._include:
+            return []
+        folded, positions = self._fold(text)
+        found = sorted(m.span() for p in self._include for m in p.finditer(folded) if m.end() > m.start())
+        if positions is not None:
+            found = [(positions[start], positions[end - 1] + 1) for start, end in found]
+        spans = []
+        for start, end in found:
+            if spans and start < spans[-1][1]:
+                spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+            else:
+                spans.append((start, end))
+        return spans
+
+    def matches(self, text):
+        if not text:
+            return False
+        folded = text.casefold()
+        if any(p.search(folded) is not None for p in self._exclude):
+            return False
+        if not self._include:
+            return True
+        return any(p.search(folded) is not None for p in self._include)
+
+    def highlight(self, text):
+        # escapes the text around and inside each match, so the result is ready for HTML parse mode
+        if not text:
+            return text
+        out = []
+        pos = 0
+        for start, end in self.spans(text):
+            out.append(html.escape(text[pos:start]))
+            out.append(HIGHLIGHT_TEMPLATE.format(html.escape(text[start:end])))
+            pos = end
+        out.append(html.escape(text[pos:]))
+        return "".join(out)
+
+def build_keyword_matcher(cfg):
+    keywords = cfg.get("keywords", [])
+    if not isinstance(keywords, list):
+        raise ValueError("keywords must be a list")
+    exclude = cfg.get("exclude_keywords", [])
+    if not isinstance(exclude, list):
+        raise ValueError("exclude_keywords must be a list")
+    regex = cfg.get("regex_keywords", [])
+    if not isinstance(regex, list):
+        raise ValueError("regex_keywords must be a list")
+    for group in (keywords, exclude, regex):
+        for k in group:
+            if not isinstance(k, str):
+                raise ValueError(f"Keyword entries must be strings, got {k!r}")
+    return KeywordMatcher(keywords, exclude, regex, cfg.get("whole_word_keywords", False))
 
 def escape_html(text):
     if not text:
         return text
     return html.escape(text)
 
-def highlight_keywords(text, keywords):
-    if not text or not keywords:
-        return text
-    sorted_keywords = sorted(keywords, key=len, reverse=True)
-    escaped_keywords = [re.escape(k) for k in sorted_keywords]
-    pattern = re.compile("|".join(escaped_keywords), re.IGNORECASE)
-    
-    def replace(match):
-        return f"<u><b><i>{match.group(0)}</i></b></u>"
-        
-    return pattern.sub(replace, text)
+MEDIA_KINDS = ("text", "photo", "video", "gif", "sticker", "voice", "audio", "document", "poll", "other")
+
+def media_kind(msg):
+    media = getattr(msg, "media", None)
+    if media is None or getattr(media, "webpage", None) is not None:
+        return "text"
+    # gif before video and voice before audio: telethon reports both for those documents
+    for kind in ("gif", "sticker", "voice", "video", "audio", "photo", "poll"):
+        if getattr(msg, kind, None):
+            return kind
+    if getattr(media, "photo", None) is not None:
+        return "photo"
+    if getattr(media, "document", None) is not None:
+        return "document"
+    return "other"
+
+def media_file_id(msg):
+    media = getattr(msg, "media", None)
+    if media is None:
+        return None
+    for attr in ("photo", "document"):
+        obj = getattr(media, attr, None)
+        oid = getattr(obj, "id", None)
+        if oid is not None:
+            return f"{attr}:{oid}"
+    return None
 
 def strip_signature(text, delimiters):
     if not text: